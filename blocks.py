@@ -0,0 +1,49 @@
+class Block(object):
+    __slots__ = ('edges', 'occupants', 'guards')
+
+    def __init__(self):
+        self.edges = []
+        self.occupants = 0  # Trains and wagons on any of the edges
+        self.guards = []  # (signal, light) of every light that guards the block
+
+    def isOccupied(self):
+        return self.occupants > 0
+
+
+class Blocks(object):
+    # The edges of a Graph split into blocks: the largest sets of edges that are joined by nodes other than signals.
+    # A signal light guards the block on its far side, as given by the signal's getGuarded(). Made once per graph
+    # version, with occupants counted from Edge.busy; after that, edges keep the counts up to date as occupants come
+    # and go.
+
+    def __init__(self, graph, boundary_types=()):
+        self.version = graph.version
+        self.by_edge = {}  # Edge -> Block
+        self.blocks = []
+        for edge in graph.edges.itervalues():
+            if edge in self.by_edge:
+                continue
+            block = Block()
+            self.blocks.append(block)
+            self.by_edge[edge] = block
+            todo = [edge]
+            while todo:
+                current = todo.pop()
+                block.edges.append(current)
+                block.occupants += len(current.busy)
+                for node in (current.lnode, current.hnode):
+                    if node.type in boundary_types:
+                        continue
+                    for nbor_edge in node.edges:
+                        if nbor_edge not in self.by_edge:
+                            self.by_edge[nbor_edge] = block
+                            todo.append(nbor_edge)
+        for node in graph.nodes:
+            if node.type in boundary_types:
+                for light, nbor in node.getGuarded():
+                    edge = node.getEdge(nbor)
+                    if edge is not None:
+                        self.by_edge[edge].guards.append((node, light))
+
+    def getBlock(self, edge):
+        return self.by_edge[edge]
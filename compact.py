@@ -0,0 +1,158 @@
+from array import array
+import heapq
+from operator import attrgetter
+import utils
+
+
+class CompactGraph(object):
+    # Read-only copy of a Graph in compressed sparse row form. Nodes are numbered 0..n-1 in the order of
+    # Graph.nodes, and the nbors of node i are targets[offsets[i]:offsets[i + 1]], with the lengths of the edges to
+    # them at the same positions in lengths. types holds the index of each node's type in the types it was built
+    # with. Everything but nodes and index is a flat array, which is cheap to pickle and to share with a forked
+    # worker process.
+    #
+    # A copy is brought up to a later version with patch(), which costs about as much as the change, not the graph.
+    # The patched copy shares the arrays, nodes and index, which are only ever appended to: new nodes get the next
+    # numbers, and the changed rows are appended to targets and lengths, and found through rows instead of offsets.
+    # number() tells which nodes a copy has, since index also holds the nodes added after it and those deleted.
+    arrays = ('xs', 'ys', 'types', 'offsets', 'targets', 'lengths')
+    patch_share = 0.125  # Once the patched rows take up this share of targets, a copy is worth making from scratch
+
+    def __init__(self, graph, types=()):
+        self.version = graph.version
+        self.nodes = list(graph.nodes)
+        index = dict((node, idx) for idx, node in enumerate(self.nodes))
+        self.index = index
+        self.size = len(self.nodes)
+        self.rows = {}  # Node number -> (start, end) in targets, of the rows patched since it was made
+        self.removed = frozenset()  # Numbers of the nodes deleted since it was made
+        self.type_codes = type_codes = dict((type, code) for code, type in enumerate(types))
+        self.xs = array('d', [node.x for node in self.nodes])
+        self.ys = array('d', [node.y for node in self.nodes])
+        self.types = array('b', [type_codes.get(node.type, -1) for node in self.nodes])
+        self.offsets = array('i', [0])
+        self.targets = array('i')
+        self.lengths = array('d')
+        for node in self.nodes:
+            for nbor in node.nbors:
+                self.targets.append(index[nbor])
+                self.lengths.append(graph.getEdge(node, nbor).length)
+            self.offsets.append(len(self.targets))
+
+    def __getstate__(self):  # Workers have no use for the real nodes. Arrays go as strings, which is many times quicker
+        state = self.__dict__.copy()
+        del state['nodes'], state['index'], state['type_codes']
+        for name in self.arrays:
+            state[name] = (state[name].typecode, state[name].tostring())
+        return state
+
+    def __setstate__(self, state):
+        for name in self.arrays:
+            state[name] = array(*state[name])
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return self.size
+
+    def number(self, node):  # node's number, or -1 if it isn't in this copy
+        idx = self.index.get(node, -1)
+        if idx >= self.size or idx in self.removed:
+            return -1
+        return idx
+
+    def patch(self, graph, nodes):
+        # A copy at graph's version, with the rows of nodes, which are the ones the changes since touched, read again.
+        # Returns None once so much has been patched that it should be made again instead.
+        base = self.offsets[-1]  # Where the rows it was made with end
+        if len(self.targets) - base + len(nodes) > self.patch_share * base:
+            return None
+        compact = CompactGraph.__new__(CompactGraph)
+        compact.__dict__.update(self.__dict__)
+        compact.version = graph.version
+        compact.rows = rows = dict(self.rows)
+        removed = set(self.removed)
+        index, targets, lengths = self.index, self.targets, self.lengths
+        for node in sorted(nodes, key=attrgetter('id')):  # New nodes are numbered in the order they were made
+            if node not in index:
+                if node.id not in graph.nodes_by_id:  # Added and deleted since
+                    continue
+                index[node] = len(self.nodes)
+                self.nodes.append(node)
+                self.xs.append(node.x)
+                self.ys.append(node.y)
+                self.types.append(self.type_codes.get(node.type, -1))
+        compact.size = len(self.nodes)
+        for node in nodes:
+            idx = index.get(node)
+            if idx is None:
+                continue
+            if node.id not in graph.nodes_by_id:
+                removed.add(idx)
+            start = len(targets)
+            for nbor in node.nbors:
+                targets.append(index[nbor])
+                lengths.append(graph.getEdge(node, nbor).length)
+            rows[idx] = (start, len(targets))
+        compact.removed = frozenset(removed)
+        return compact
+
+    def search(self, start, end, destination):
+        # HeapBoy.search over node numbers, with the same rules and the same tie-breaking, so that both find the
+        # very same path. The heap is a plain heapq: a node whose key drops is pushed again, and the stale entry is
+        # skipped when it comes up.
+        if end == destination:
+            return [end], set([start, end])
+        xs, ys, offsets, targets, lengths, rows = self.xs, self.ys, self.offsets, self.targets, self.lengths, self.rows
+        dest_pos = (xs[destination], ys[destination])
+        parents = {end: None}
+        gs = {end: 0}
+        hs = {end: 0}
+        keys = {}  # Key of every open node
+        open_heap = []
+        closed = set()
+        seq = 0
+        current_node = end
+        last_node = start  # For one-way rule
+        while True:
+            current_g = gs[current_node]
+            row = rows.get(current_node)
+            first, last = row if row is not None else (offsets[current_node], offsets[current_node + 1])
+            for pos in xrange(first, last):
+                nbor = targets[pos]
+                if nbor == destination:
+                    path = [nbor]
+                    node = current_node
+                    while node != end:
+                        path.append(node)
+                        node = parents[node]
+                    path.reverse()
+                    touched = set(gs)
+                    touched.update((start, destination))
+                    return path, touched
+
+                if nbor == last_node or nbor in closed:
+                    continue
+
+                seq -= 1
+                g = current_g + lengths[pos]
+                if nbor not in gs:
+                    h = hs[nbor] = utils.getDistance(dest_pos, (xs[nbor], ys[nbor]))
+                    gs[nbor], parents[nbor] = g, current_node
+                else:
+                    h = hs[nbor]
+                    if g < gs[nbor]:
+                        gs[nbor], parents[nbor] = g, current_node
+                key = keys[nbor] = (gs[nbor] + h, seq)
+                heapq.heappush(open_heap, (key, nbor))
+
+            closed.add(current_node)
+            last_node = current_node
+
+            while open_heap and keys.get(open_heap[0][1]) != open_heap[0][0]:
+                heapq.heappop(open_heap)
+            if not open_heap:
+                touched = set(gs)
+                touched.add(start)
+                return [], touched
+            current_node = heapq.heappop(open_heap)[1]
+            del keys[current_node]
@@ -0,0 +1,114 @@
+from collections import defaultdict, deque
+from operator import attrgetter
+
+
+class ComponentIndex(object):
+    # Connected component label of every node in a Graph. Nodes carry labels, and labels are merged with union-find
+    # when an edge joins two components. When an edge or node goes away, the two sides are searched breadth first,
+    # in step, from both ends. If they meet, nothing changed; otherwise the side that ran out first, the smaller one,
+    # gets a fresh label. A search that meets covers about the nodes within half the length of the other way round,
+    # and one that doesn't covers the smaller side twice over. That is cheap for a short loop or a small piece cut
+    # off, but a long loop, i.e. one edge taken out of a ring, has the searches go round all of it.
+
+    def __init__(self):
+        self.labels = {}  # node -> label
+        self.parents = {}  # label -> parent label, roots are their own parent
+        self.next_label = 0
+        self.merges = 0  # Bumped whenever two components become one
+        self.suspects = None  # While deferring, the nodes next to removals, which may have come apart
+
+    def newLabel(self):
+        label = self.next_label
+        self.next_label += 1
+        self.parents[label] = label
+        return label
+
+    def find(self, label):
+        parents = self.parents
+        while parents[label] != label:
+            parents[label] = parents[parents[label]]  # Path halving
+            label = parents[label]
+        return label
+
+    def getComponent(self, node):
+        label = self.labels.get(node)
+        return None if label is None else self.find(label)
+
+    def connected(self, from_, to):
+        component = self.getComponent(from_)
+        return component is not None and component == self.getComponent(to)
+
+    def addNode(self, node):
+        self.labels[node] = self.newLabel()
+
+    def addEdge(self, from_, to):
+        from_root, to_root = self.find(self.labels[from_]), self.find(self.labels[to])
+        if from_root != to_root:
+            self.parents[to_root] = from_root
+            self.merges += 1
+
+    def removeEdge(self, from_, to, removed=None):
+        # Call after the edge is gone from both nodes' nbors. removed is a node on its way out, not to be searched.
+        # Returns whether from_ and to are still connected.
+        if self.suspects is not None:
+            self.suspects.update((from_, to))
+            return None
+        return self.separate(from_, to, removed) is None
+
+    def separate(self, from_, to, removed=None):
+        # Searches from both ends, not going through removed. Returns None if they meet. Otherwise the end whose side
+        # ran out first, which gets a fresh label as a component of its own.
+        visited = (set([from_]), set([to]))
+        todo = (deque([from_]), deque([to]))
+        while True:
+            for side in (0, 1):
+                if not todo[side]:  # This side ran out without meeting the other
+                    label = self.newLabel()
+                    for node in visited[side]:
+                        self.labels[node] = label
+                    return (from_, to)[side]
+                node = todo[side].popleft()
+                for nbor in node.nbors:
+                    if nbor is removed:
+                        continue
+                    if nbor in visited[1 - side]:
+                        return None
+                    if nbor not in visited[side]:
+                        visited[side].add(nbor)
+                        todo[side].append(nbor)
+
+    def removeNode(self, node):  # Call before the node is unhooked from its nbors
+        nbors = node.nbors
+        if self.suspects is not None:
+            self.suspects.update(nbors)
+            del self.labels[node]
+            return
+        for idx, nbor in enumerate(nbors):
+            for other in nbors[:idx]:
+                # Once nbor is found still connected to an earlier nbor, it shares that one's fate with the rest
+                if self.connected(other, nbor) and self.removeEdge(other, nbor, node):
+                    break
+        del self.labels[node]
+
+    def defer(self):
+        # Until resolve(), removals only note their nbors, and connected() may report nodes that came apart as still
+        # connected. For many edits at once, where searching after each removal would add up.
+        self.suspects = set()
+
+    def resolve(self):
+        # Every piece of a component that came apart holds a suspect. The suspects of each old component are searched
+        # for one after the other from the one piece of it not yet known to be whole, like removeEdge does, so only
+        # pieces that really came apart are labelled, and only searched through if they are the smaller side.
+        suspects, self.suspects = self.suspects, None
+        groups = defaultdict(list)
+        for suspect in sorted(suspects, key=attrgetter('id')):
+            if suspect in self.labels:  # Not deleted since
+                groups[self.find(self.labels[suspect])].append(suspect)
+        first = self.next_label  # Pieces get labels from here on once they are known to be whole
+        for group in groups.itervalues():
+            rest = None  # A suspect in the piece that keeps the old label, unless a later suspect turns out bigger
+            for suspect in group:
+                if self.labels[suspect] >= first:  # In a piece labelled whole already
+                    continue
+                if rest is None or self.separate(rest, suspect) is rest:
+                    rest = suspect
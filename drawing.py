@@ -53,44 +53,31 @@ def Station_draw(resource_types, x, y, resources):
                       width=150).draw()
 
 
-def Signal_draw(x, y, nw, se, nw_node, se_node):
-    if nw is not None:
-        sx, sy = utils.getPointRelativeLine((x * TILE_SIZE, y * TILE_SIZE), (-5, -5),
-                                            (nw_node.x, nw_node.y),
-                                            (se_node.x, se_node.y))
-        tiny_circle.x = sx
-        tiny_circle.y = sy
-        if nw is True:
-            tiny_circle.color = (0, 255, 0, 1)
-        else:
-            tiny_circle.color = (255, 0, 0, 1)
-        tiny_circle.render()
-
-        sbx, sby = utils.getPointRelativeLine((x * TILE_SIZE, y * TILE_SIZE), (-6, -5),
-                                              (nw_node.x, nw_node.y),
-                                              (se_node.x, se_node.y))
-        tiny_circle_filled.x, tiny_circle_filled.y = sbx, sby
-        tiny_circle_filled.color = (0.3, 0.3, 0.3, 1)
-        tiny_circle_filled.render()
-
-    if se is not None:
-        sx, sy = utils.getPointRelativeLine((x * TILE_SIZE, y * TILE_SIZE), (5, 5),
-                                            (nw_node.x, nw_node.y),
-                                            (se_node.x, se_node.y))
-        tiny_circle.x = sx
-        tiny_circle.y = sy
-        if se is True:
-            tiny_circle.color = (0, 255, 0, 1)
-        else:
-            tiny_circle.color = (255, 0, 0, 1)
-        tiny_circle.render()
-
-        sbx, sby = utils.getPointRelativeLine((x * TILE_SIZE, y * TILE_SIZE), (6, 5),
-                                              (nw_node.x, nw_node.y),
-                                              (se_node.x, se_node.y))
-        tiny_circle_filled.x, tiny_circle_filled.y = sbx, sby
-        tiny_circle_filled.color = (0.3, 0.3, 0.3, 1)
-        tiny_circle_filled.render()
+def Signals_draw(signals):
+    # The lights of every signal, and the dark backs behind them. Where each goes along its signal's track is worked
+    # out for all the signals at once.
+    if not signals:
+        return
+    xs, ys = [signal.x * TILE_SIZE for signal in signals], [signal.y * TILE_SIZE for signal in signals]
+    lines = ([signal.nw_node.x for signal in signals], [signal.nw_node.y for signal in signals],
+             [signal.se_node.x for signal in signals], [signal.se_node.y for signal in signals])
+    for light, light_point, back_point in (('nw', (-5, -5), (-6, -5)), ('se', (5, 5), (6, 5))):
+        light_xs, light_ys = utils.getPointsRelativeLines(xs, ys, light_point, *lines)
+        back_xs, back_ys = utils.getPointsRelativeLines(xs, ys, back_point, *lines)
+        for i, signal in enumerate(signals):
+            state = getattr(signal, light)
+            if state is None:
+                continue
+            tiny_circle.x, tiny_circle.y = light_xs[i], light_ys[i]
+            if state is True:
+                tiny_circle.color = (0, 255, 0, 1)
+            else:
+                tiny_circle.color = (255, 0, 0, 1)
+            tiny_circle.render()
+
+            tiny_circle_filled.x, tiny_circle_filled.y = back_xs[i], back_ys[i]
+            tiny_circle_filled.color = (0.3, 0.3, 0.3, 1)
+            tiny_circle_filled.render()
 
 
 def Edge_draw(lnode, hnode, is_busy):
@@ -113,7 +100,7 @@ def Train_draw(resource_types, x, y, wagons):
     circle.x, circle.y = x * TILE_SIZE, y * TILE_SIZE
     circle.color = (1, 0, 0, 1)
     circle.render()
-    [wagon.draw() for wagon in wagons]
+    [Wagon_draw(wagon.x, wagon.y) for wagon in wagons]
     cargo = {}
     for wagon in wagons:
         cargo[wagon.type] = cargo.get(wagon.type, 0) + wagon.cargo
@@ -0,0 +1,797 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+import utils
+from pathfinding import HeapBoy, PathCache, IncrementalBoy, Landmarks
+from overlay import OverlayBoy
+from replanning import BatchReplanner, AsyncReplanner
+from components import ComponentIndex
+from compact import CompactGraph
+from blocks import Blocks
+from spatial import GridIndex, SegmentIndex
+import kinematics
+from scheduler import Scheduler
+from trail import Trail
+from journal import Journal, NodeAdded, NodeRemoved, NodeReplaced, EdgeAdded, EdgeRemoved, OccupancyChanged, \
+    SignalToggled, changedNodes
+
+resource_types = {0: "goods"}
+
+
+class Trader(object):
+    def __init__(self, id, x, y, produces, consumes):
+        self.id, self.x, self.y, self.produces, self.consumes = id, x, y, produces, consumes
+        self.connections = []
+        self.delete = False
+
+    def update(self, dt):
+        for connection in self.connections:
+            for type, rate in self.produces.items():
+                connection.supplyResource(self, type, rate * dt / len(self.connections))
+
+
+class Node(object):
+    # Entities that a big map has many of use __slots__, so that they don't carry a __dict__ each
+    __slots__ = ('id', 'x', 'y', 'nbors', 'edges')
+    type = object()
+
+    def __init__(self, id, x, y):
+        self.id, self.x, self.y = id, x, y
+        self.nbors = []
+        self.edges = []  # edges[i] joins the node to nbors[i]. A list, since a dict would be most of a node's size
+
+    def __getstate__(self):  # nbors and edges are saved by the Graph, so that pickling doesn't recurse along the track
+        return dict((name, getattr(self, name)) for cls in type(self).__mro__ for name in getattr(cls, '__slots__', ())
+                    if name not in ('nbors', 'edges') and hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            setattr(self, name, value)
+        self.nbors = []
+        self.edges = []
+
+    def getEdge(self, nbor):  # None if there is no edge to nbor
+        for idx, other in enumerate(self.nbors):
+            if other is nbor:
+                return self.edges[idx]
+        return None
+
+    def removeNbor(self, nbor):  # Take away nbor and the edge to it, and return the edge
+        idx = self.nbors.index(nbor)
+        del self.nbors[idx]
+        return self.edges.pop(idx)
+
+    def isBusy(self):
+        return any(edge.isBusy() for edge in self.edges)
+
+    def __repr__(self):
+        return str(self.id)
+
+
+class Station(Node):
+    __slots__ = ('resources', 'connections')
+    type = object()
+    reach = 5  # Traders closer than this are connected
+
+    def __init__(self, id, x, y):
+        super(Station, self).__init__(id, x, y)
+        self.resources = {}
+        self.connections = []
+
+    def supplyResource(self, source, type, amount):
+        if source not in self.resources:
+            self.resources[source] = {}
+        if type not in self.resources[source]:
+            self.resources[source][type] = 0
+        self.resources[source][type] += amount
+
+    def loadResource(self, type, amount):
+        for source, resources in self.resources.items():
+            if source is None:
+                continue
+            available = resources.get(type, 0)
+            load = min(available, amount)
+            resources[type] -= load
+            return load
+        return 0
+
+    def unloadResource(self, type, amount):
+        self.supplyResource(None, type, amount)
+
+    def acceptsResource(self, type):
+        return any(type in connection.consumes for connection in self.connections)
+
+
+class Signal(Node):
+    __slots__ = ('nw_node', 'se_node', 'nw', 'se')
+    type = object()
+
+    def __init__(self, id, x, y, nw, se):
+        super(Signal, self).__init__(id, x, y)
+        self.nw_node, self.se_node = nw, se
+        self.nw = self.se = True
+
+    def __cmp__(self, other):
+        return 1 if (self.x, self.y) > (other.x, other.y) else -1
+
+    def __eq__(self, other):
+        return self is other
+
+    def toggleDirection(self):
+        if self.nw is not None and self.se is not None:
+            self.se = None
+        elif self.se is None:
+            self.se, self.nw = True, None
+        else:
+            self.nw = self.se = True
+
+    def getGuarded(self):  # (light, nbor) of both lights, where the light guards the block beyond nbor
+        return ('se', self.nw_node), ('nw', self.se_node)
+
+
+class Edge(object):
+    __slots__ = ('graph', 'lnode', 'hnode', 'length', 'busy', 'offsets')
+
+    def __init__(self, graph, lnode, hnode):
+        self.graph = graph  # Which the trains on it reach their graph and engine through
+        self.lnode, self.hnode = lnode, hnode
+        self.length = utils.getNodeDistance(lnode, hnode)
+        # Trains and wagons on the edge, by their offset from lnode, and those offsets, to search with bisect. Empty
+        # tuples while there are none, since most edges are empty most of the time, and all empty tuples are the same
+        # one. Lists otherwise, which occupants that pass each other are moved around in.
+        self.busy = self.offsets = ()
+
+    def getOffset(self, start, pos):  # Distance from lnode of the point at pos along the edge, going from start
+        return pos * self.length if start is self.lnode else (1 - pos) * self.length
+
+    def findOffset(self, offset):  # Where an occupant at offset goes in busy, after any at the same offset
+        return bisect_right(self.offsets, offset)
+
+    def findFirst(self, offset):  # Where the first occupant at or after offset is in busy
+        return bisect_left(self.offsets, offset)
+
+    def addOccupant(self, occupant, offset):
+        block = self.graph.getBlocks().getBlock(self)  # Before busy changes, since new blocks count what is on it
+        if not self.busy:
+            self.graph.traffic.append(OccupancyChanged(self))
+        occupant.offset = offset
+        if self.busy:
+            idx = self.findOffset(offset)
+            self.busy.insert(idx, occupant)
+            self.offsets.insert(idx, offset)
+        else:
+            self.busy, self.offsets = [occupant], [offset]
+        block.occupants += 1
+
+    def moveOccupant(self, occupant, offset):
+        busy, offsets = self.busy, self.offsets
+        idx = busy.index(occupant, self.findFirst(occupant.offset))  # Looked for from where it was, not from the start
+        occupant.offset = offset
+        if (idx and offsets[idx - 1] > offset) or (idx + 1 < len(offsets) and offsets[idx + 1] < offset):
+            del busy[idx], offsets[idx]  # Passed another occupant, take it out and put it back
+            idx = self.findOffset(offset)
+            busy.insert(idx, occupant)
+            offsets.insert(idx, offset)
+        else:
+            offsets[idx] = offset
+
+    def getAhead(self, start, offset):
+        # Iterates over the occupants at or beyond offset, nearest first, going away from start. Nothing is copied, so
+        # the lookahead costs a bisection and then one step per occupant looked at.
+        busy = self.busy
+        if start is self.lnode:
+            return (busy[idx] for idx in xrange(self.findFirst(offset), len(busy)))
+        return (busy[idx] for idx in xrange(self.findOffset(offset) - 1, -1, -1))
+
+    def removeOccupant(self, occupant):
+        if occupant in self.busy:
+            block = self.graph.getBlocks().getBlock(self)
+            idx = self.busy.index(occupant)
+            del self.busy[idx], self.offsets[idx]
+            if not self.busy:
+                self.busy = self.offsets = ()
+            block.occupants -= 1
+        if not self.busy:
+            self.graph.traffic.append(OccupancyChanged(self))
+
+    def isBusy(self):  # Is there a train/wagon on this edge
+        return bool(self.busy)
+
+    def isRouteBusy(self):  # Is there a train/wagon on any edge connected by signals
+        if self.busy:
+            return True
+        for last_node, node in ((self.lnode, self.hnode), (self.hnode, self.lnode)):
+            if node.type is Signal.type:
+                while True:
+                    remote_end = node.nw_node if node.nw_node is not last_node else node.se_node
+                    if self.graph.getEdge(node, remote_end).isBusy():
+                        return True
+                    if remote_end.type is Signal.type:
+                        last_node, node = node, remote_end
+                    else:
+                        break
+        return False
+
+
+class Graph(object):
+    # Nodes are kept by id, and every node keeps its edges by nbor, so that nothing has to search a list to add or
+    # remove a node or an edge. edges holds the same Edges by (lower id node, higher id node).
+
+    def __init__(self):
+        self.nodes_by_id = OrderedDict()
+        self.edges = {}
+        self.next_node_id = 0
+        self.version = 0  # Bumped on every structural change
+        self.journal = Journal()  # Structural changes
+        self.traffic = Journal()  # The other changes, which come every tick, and would push those out of journal
+        self.components = ComponentIndex()
+        self.node_index = GridIndex()
+        self.edge_index = SegmentIndex()
+        self.batch_depth = 0
+        self.engine = None  # The Engine running on it, set by the engine
+        self.compact = None  # CompactGraph of the current version, made when first asked for
+        self.compact_changes = None  # Journal cursor of the changes the compact doesn't have yet
+        self.blocks = None  # Blocks of the current version, made when first asked for
+
+    def __getstate__(self):  # Derived structures are cheaper to make again than to save, and journals are of no use
+        state = self.__dict__.copy()
+        state['compact'] = state['compact_changes'] = state['blocks'] = state['journal'] = state['traffic'] = None
+        state['engine'] = None
+        state['nbors'] = [node.nbors for node in self.nodes_by_id.itervalues()]
+        return state
+
+    def __setstate__(self, state):
+        nbors = state.pop('nbors')
+        self.__dict__.update(state)
+        self.journal = Journal()
+        self.traffic = Journal()
+        for node, node_nbors in zip(self.nodes_by_id.itervalues(), nbors):
+            node.nbors = node_nbors
+            node.edges = [self.edges[(node, nbor) if node.id < nbor.id else (nbor, node)] for nbor in node_nbors]
+        if self.batch_depth:  # Saved from inside a batch, i.e. by a tool. Finish it, now that the nodes have nbors
+            self.batch_depth = 0
+            self.components.resolve()
+
+    @contextmanager
+    def batch(self):
+        # Groups many edits, i.e. a whole line laid by a tool or a script. Index maintenance that would search after
+        # every edit is done once, when the outermost batch ends. Signals, paths and connections are brought up to
+        # date from the journal on the next tick anyway, once for the whole batch.
+        if not self.batch_depth:
+            self.components.defer()
+        self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            self.batch_depth -= 1
+            if not self.batch_depth:
+                self.components.resolve()
+
+    def record(self, change):
+        self.version += 1
+        self.journal.append(change)
+
+    @property
+    def nodes(self):  # In the order they were created
+        return self.nodes_by_id.values()
+
+    def getCompact(self):
+        # Patched with the nodes the journal says have changed, so that asking after every edit stays cheap
+        if self.compact is not None and self.compact.version != self.version:
+            changes = self.compact_changes.read()
+            self.compact = None if changes is None else self.compact.patch(self, changedNodes(changes))
+        if self.compact is None:
+            self.compact = CompactGraph(self, (Node.type, Signal.type, Station.type))
+            self.compact_changes = self.journal.cursor()
+        return self.compact
+
+    def getBlocks(self):
+        if self.blocks is None or self.blocks.version != self.version:
+            self.blocks = Blocks(self, (Signal.type,))
+        return self.blocks
+
+    def createNode(self, x, y, cls=None, args=None, kwargs=None):
+        cls = Node if cls is None else cls
+        args = [] if args is None else args
+        kwargs = {} if kwargs is None else kwargs
+
+        node = cls(self.next_node_id, x, y, *args, **kwargs)
+        self.next_node_id += 1
+        self.nodes_by_id[node.id] = node
+        self.node_index.add(node)
+        self.record(NodeAdded(node))
+        self.components.addNode(node)
+        return node
+
+    def connectNodes(self, from_, to):
+        if from_ is to:
+            raise Exception("Cannot connect to self!")
+
+        self.record(EdgeAdded(from_, to))
+        edge = from_.getEdge(to)
+        if edge is None:
+            n_edge = (from_, to) if from_.id < to.id else (to, from_)
+            edge = self.edges[n_edge] = Edge(self, *n_edge)
+            from_.nbors.append(to)
+            to.nbors.append(from_)
+            from_.edges.append(edge)
+            to.edges.append(edge)
+            self.edge_index.add(edge)
+
+        # Update signals nw/se_node
+        if from_.type is Signal.type:
+            if from_ > to:  # Uses __cmp__
+                from_.nw_node = to
+            else:
+                from_.se_node = to
+
+        if to.type is Signal.type:
+            if to > from_:  # Uses __cmp
+                to.nw_node = from_
+            else:
+                to.se_node = from_
+
+        self.components.addEdge(from_, to)
+
+    def insertNode(self, point, from_, to, type=Node.type):
+        self.record(EdgeRemoved(from_, to))
+        self.unlink(from_, to)
+        if type is Signal.type:
+            cls = Signal, (from_, to) if from_ < to else (to, from_)  # Uses __cmp__
+        elif type is Station.type:
+            cls = (Station,)
+        else:
+            cls = ()
+        new_node = self.createNode(point[0], point[1], *cls)
+        self.connectNodes(from_, new_node)
+        self.connectNodes(new_node, to)
+        return new_node
+
+    def prune(self, node):
+        if node.type is Signal.type:
+            if len(node.nbors) == 1:
+                self.deleteNode(node)
+                return True
+        elif not node.nbors:
+            self.deleteNode(node)
+            return True
+
+    def unlink(self, from_, to):  # Take away the edge between two nodes, and nothing else
+        edge = from_.removeNbor(to)
+        to.removeNbor(from_)
+        del self.edges[edge.lnode, edge.hnode]
+        self.edge_index.remove(edge)
+
+    def deleteNode(self, node):
+        self.record(NodeRemoved(node, tuple(node.nbors)))
+        del self.nodes_by_id[node.id]
+        self.node_index.remove(node)
+        if node.type is Signal.type:
+            if len(node.nbors) == 2:
+                self.connectNodes(*node.nbors)
+        self.components.removeNode(node)  # Now, since pruning below only ever takes away dead ends
+
+        nbors, edges = node.nbors, node.edges
+        node.nbors, node.edges = [], []  # Nothing can reach a deleted node, so it should not reach anything either
+        for nbor, edge in zip(nbors, edges):
+            if self.edges.get((edge.lnode, edge.hnode)) is not edge:  # Taken away already, by pruning that came back
+                continue
+            del self.edges[edge.lnode, edge.hnode]
+            self.edge_index.remove(edge)
+            if node in nbor.nbors:
+                nbor.removeNbor(node)
+                self.prune(nbor)
+
+    def deleteEdge(self, from_, to):
+        self.record(EdgeRemoved(from_, to))
+        self.unlink(from_, to)
+        self.components.removeEdge(from_, to)  # Before pruning, which only ever takes away dead ends
+        self.prune(from_)
+        self.prune(to)
+
+    def replaceNode(self, node, cls):
+        new_node = self.createNode(node.x, node.y, cls)
+        for nbor in node.nbors:
+            self.connectNodes(new_node, nbor)
+        self.deleteNode(node)
+        self.record(NodeReplaced(node, new_node))
+
+    def getEdge(self, from_, to):
+        return self.edges[(from_, to) if from_.id < to.id else (to, from_)]
+
+    def toggleSignal(self, signal):
+        signal.toggleDirection()
+        self.traffic.append(SignalToggled(signal))
+
+
+class Wagon(object):
+    __slots__ = ('x', 'y', 'edge', 'offset', 'type', 'capacity', 'cargo')
+    size = 0.5
+    loading_speed = 20
+
+    def __init__(self, type=0, capacity=10):
+        self.x = self.y = 0
+        self.edge = None
+        self.offset = 0  # From edge.lnode
+        self.type, self.capacity = type, capacity
+        self.cargo = 0
+
+
+class Train(object):
+    __slots__ = ('edge', 'destination', 'origin', 'start', 'end', 'pos', 'offset', 'x', 'y', 'dirty', 'path', 'wagons',
+                 'trail')
+    speed = 5
+    size = 0.5
+    separation = 1  # In moving block mode, the distance kept to whatever is ahead
+
+    def __init__(self, edge, start, destination):
+        self.edge = edge
+        self.destination = destination
+        self.origin = start
+        self.start = start
+        self.end = start
+        self.pos = 0.0
+        self.offset = 0  # From edge.lnode
+        self.x, self.y = self.start.x, self.start.y
+        self.dirty = True
+        self.path = []
+        self.wagons = []
+        self.trail = Trail()
+        self.addWagon(Wagon())
+        self.addWagon(Wagon())
+        self.addWagon(Wagon())
+        self.addWagon(Wagon())
+        self.addWagon(Wagon())
+
+    def addWagon(self, wagon):
+        self.wagons.append(wagon)
+
+    def updateCoords(self, dt):
+        if self.start is not self.end:  # start == end means train is newly created with no orders
+            step = self.speed * dt
+            moving_block = self.edge.graph.engine.moving_block
+            if moving_block:  # Don't come closer than separation to what is ahead
+                distance = self.getDistanceAhead(step + self.separation)
+                if distance is not None:
+                    step = max(0, min(step, distance - self.separation))
+            self.pos += step / self.edge.length
+            # Move to new edge, or we're at our goal
+            if self.pos >= 1:
+                if not moving_block and self.shouldStopForSignal():
+                    self.pos = 1
+                elif not self.path:
+                    # We have reached our goal. Transfer cargo or head to origin
+                    if self.end is self.destination:
+                        if not self.transferCargo(dt, self.end):  # Transfer cargo if available, then head to origin
+                            self.start = self.end = self.destination
+                            self.pos = 0
+                            self.destination, self.origin = self.origin, self.destination
+                            self.trail.clear()
+                            self.edge.removeOccupant(self)
+                            self.dirty = True
+                        else:
+                            self.pos = 1  # Wait while transferring cargo
+                    # There is no path to our goal, stand still and wait until a path is found
+                    else:
+                        self.pos = 1
+                # The path was searched before the track ahead was taken away, i.e. in the background. Wait at the end
+                # of the edge for a new one
+                elif self.path[0] not in self.end.nbors:
+                    self.pos = 1
+                    self.path = []
+                    self.dirty = True
+                # Move to new edge
+                else:
+                    if self.wagons:
+                        self.trail.append(self.start)
+                    self.start = self.end
+                    self.end = self.path[0]
+                    del self.path[0]
+                    new_edge = self.edge.graph.getEdge(self.start, self.end)
+                    self.pos = (self.pos * self.edge.length - self.edge.length) / new_edge.length
+                    self.edge.removeOccupant(self)
+                    self.edge = new_edge
+                    self.edge.addOccupant(self, self.edge.getOffset(self.start, self.pos))
+
+            # Update the position of the train based on its pos on the edge
+            self.x, self.y = utils.getNodePointAlongLine(self.start, self.end, self.pos)
+            if self.start is not self.end:
+                self.edge.moveOccupant(self, self.edge.getOffset(self.start, self.pos))
+
+        # Update wagon positions if moving
+        if self.start is not self.end:
+            self.updateWagons()
+
+    def updateWagons(self):
+        offset = 0
+        for i, wagon in enumerate(self.wagons):
+            offset += wagon.size
+
+            # Get a point on an edge in the trail at offset from the train pos
+            edge, start, end, pos, point = self.getPointBehind(offset)
+            # Update busy state and clean trail if last wagon
+            if wagon.edge != edge:
+                if wagon.edge:
+                    wagon.edge.removeOccupant(wagon)
+                    if self.trail and i == len(self.wagons) - 1:
+                        self.trail.popFirst()
+                wagon.edge = edge
+                edge.addOccupant(wagon, edge.getOffset(start, pos))
+            else:
+                edge.moveOccupant(wagon, edge.getOffset(start, pos))
+
+            if point:
+                wagon.x, wagon.y = point
+
+    def shouldStopForSignal(self):
+        if self.end.type is Signal.type:
+            if self.start == self.end.nw_node and self.end.nw is not None and not self.end.nw:
+                return True
+
+            if self.start == self.end.se_node and self.end.se is not None and not self.end.se:
+                return True
+
+        return False
+
+    def getDistanceAhead(self, limit):
+        # Distance to the nearest train or wagon ahead along the path, not counting our own, or None if there is none
+        # within limit. Looks along edges in busy order, without going through every occupant.
+        edge, start, end, offset = self.edge, self.start, self.end, self.edge.getOffset(self.start, self.pos)
+        distance = 0
+        path = iter(self.path)
+        while True:
+            for occupant in edge.getAhead(start, offset):
+                if occupant is not self and occupant not in self.wagons:
+                    return distance + abs(occupant.offset - offset)
+            distance += edge.length - abs(edge.getOffset(start, 0) - offset)
+            nbor = next(path, None)
+            if nbor is None or distance >= limit:
+                return None
+            edge, start, end = end.getEdge(nbor), end, nbor
+            offset = edge.getOffset(start, 0)
+
+    def transferCargo(self, dt, station):
+        working = False  # If loading/unloading, signal to chill at station
+        for wagon in self.wagons:
+            if station.acceptsResource(wagon.type) and wagon.cargo > 0:  # Unload cargo
+                amount = min(wagon.cargo, dt * wagon.loading_speed)
+                station.unloadResource(wagon.type, amount)
+                wagon.cargo -= amount
+                working = True
+
+            space = wagon.capacity - wagon.cargo
+            if space > 0:  # Load cargo
+                amount = station.loadResource(wagon.type, min(space, dt * wagon.loading_speed))
+                if amount:
+                    wagon.cargo += amount
+                    working = True
+
+        return working
+
+    def getTransferTime(self, station):
+        # How long transferCargo keeps working at station at most, if it isn't supplied in the meantime
+        time = 0
+        for wagon in self.wagons:
+            if station.acceptsResource(wagon.type):
+                time = max(time, wagon.cargo / float(wagon.loading_speed))
+            available = sum(resources.get(wagon.type, 0) for source, resources in station.resources.items()
+                            if source is not None)
+            time = max(time, min(wagon.capacity - wagon.cargo, available) / float(wagon.loading_speed))
+        return time
+
+    def getPointBehind(self, distance):
+        # (edge, node nearer the train, node further back, pos from the nearer node, point) of the point distance
+        # behind the train, along its edge and then its trail. Where the trail runs out, the end of it, with a point
+        # of None.
+        edge = self.edge
+        pos = 1 - self.pos + distance / edge.length
+        if pos <= 1:  # On the train's own edge
+            return edge, self.end, self.start, pos, utils.getNodePointAlongLine(self.end, self.start, pos)
+        trail = self.trail
+        if not trail:
+            return edge, self.end, self.start, 1, None
+
+        behind = pos * edge.length - edge.length  # Behind start
+        last_node = trail.getLast()
+        last_edge = last_node.getEdge(self.start)
+        pos = behind / last_edge.length
+        if pos <= 1:  # On the edge from the newest node in the trail
+            return last_edge, self.start, last_node, pos, utils.getNodePointAlongLine(self.start, last_node, pos)
+
+        # Further back, where the distances along the trail tell which edge it is on
+        distance = trail.getEnd() - (behind - last_edge.length)
+        idx = trail.find(distance)
+        if idx is None:
+            if len(trail) == 1:
+                return last_edge, self.start, last_node, 1, None
+            first = trail.first
+            return trail.edges[first + 1], trail.nodes[first + 1], trail.nodes[first], 1, None
+        if idx == len(trail.nodes) - 1:  # Rounding put it right at the newest node
+            return last_edge, self.start, last_node, 1, utils.getNodePointAlongLine(self.start, last_node, 1)
+        edge, nearer, further = trail.edges[idx + 1], trail.nodes[idx + 1], trail.nodes[idx]
+        pos = (trail.distances[idx + 1] - distance) / edge.length
+        return edge, nearer, further, pos, utils.getNodePointAlongLine(nearer, further, pos)
+
+    def update(self, dt):
+        self.updateCoords(dt)
+
+    def newPath(self, path):
+        if path:
+            if self.start is self.end:  # Newly created, has no direction/edge yet
+                self.end = path[0]
+                self.edge = self.edge.graph.getEdge(self.start, self.end)
+                self.edge.addOccupant(self, self.edge.getOffset(self.start, self.pos))
+
+            if self.end is path[0]:
+                del path[0]
+        self.path = path
+
+
+class Engine(object):
+    # The simulation without any GUI: a graph, the trains on it and the traders around it. step() advances it by dt
+    # seconds, and run() by a number of fixed timestep ticks, as fast as it goes. A GUI is just one driver of it.
+    timestep = 1 / 120.0
+    incremental_pathfinding = False  # Keep per-destination search trees alive across graph changes
+    corridor_pathfinding = False  # Search junction to junction, skipping over plain track
+    parallel_replanning = False  # Replan large numbers of trains in a pool of worker processes
+    async_replanning = False  # Replan in the background, letting trains follow their old paths meanwhile
+    landmark_count = 0  # Stations used as landmarks for the A* heuristic, 0 for just the straight line distance
+    moving_block = False  # Trains run past signals, keeping Train.separation to whatever is ahead. One way track only
+    vectorized_motion = False  # Move trains in bulk with NumPy, if it is installed
+    event_driven = False  # Only update trains when something happens to them, unless moving block. See settle()
+
+    def __init__(self):
+        self.graph = Graph()
+        if self.incremental_pathfinding:
+            self.pathfinder = IncrementalBoy(self.graph)
+        elif self.corridor_pathfinding:
+            self.pathfinder = PathCache(OverlayBoy(self.graph, (Station.type,)))
+        else:
+            landmarks = Landmarks(self.landmark_count, (Station.type,)) if self.landmark_count else None
+            self.pathfinder = PathCache(HeapBoy(self.graph, landmarks))
+        self.batch_replanner = BatchReplanner() if self.parallel_replanning else None
+        self.async_replanner = AsyncReplanner() if self.async_replanning else None
+        self.kinematics = kinematics.Kinematics() if self.vectorized_motion and kinematics.numpy else None
+        self.scheduler = Scheduler() if self.event_driven and not self.moving_block else None
+        self.trains = []
+        self.traders = []
+        self.trader_index = GridIndex()
+        self.next_trader_id = 0
+        self.signal_evaluations = 0  # Lights set by updateSignals, ever. Grows with how many blocks change, not size
+        self.followGraph()
+
+    def followGraph(self):  # Start running on a new graph, and reading its journals from scratch
+        self.graph.engine = self
+        self.signal_changes = self.graph.journal.cursor(behind=True)
+        self.traffic_changes = self.graph.traffic.cursor(behind=True)
+        self.path_changes = self.graph.journal.cursor(behind=True)
+        self.connection_changes = self.graph.journal.cursor(behind=True)
+
+    def step(self, dt):
+        structural, changes = self.signal_changes.read(), self.traffic_changes.read()
+        if structural != []:  # None too, if it fell behind
+            changes = None  # Blocks may have been split, joined or guarded by new lights
+        if changes:  # Only the lights that guard blocks that emptied or filled up, and toggled lights, can change
+            blocks = self.graph.getBlocks()
+            evaluated = set()
+            for change in changes:
+                if isinstance(change, OccupancyChanged):
+                    edges = (change.edge,)
+                else:
+                    edges = change.signal.edges
+                    if self.scheduler is not None:
+                        self.scheduler.wakeSignal(change.signal)
+                for edge in edges:
+                    block = blocks.getBlock(edge)
+                    if block not in evaluated:
+                        evaluated.add(block)
+                        self.updateSignals(block)
+        if changes is None:
+            for block in self.graph.getBlocks().blocks:
+                self.updateSignals(block)
+            if self.scheduler is not None:  # The track may have changed under any of them
+                self.scheduler.wakeAll(self.trains)
+
+        if self.async_replanner is not None:
+            trains = self.async_replanner.apply(self.graph, self.pathfinder)
+            if self.scheduler is not None:
+                self.scheduler.wakeAll(trains)
+
+        if self.path_changes.read() != []:
+            self.replanTrains([train for train in self.trains if train.dirty or self.pathfinder.isStale(train)])
+        else:
+            self.replanTrains([train for train in self.trains if train.dirty])
+
+        self.updateConnections()
+
+        if self.scheduler is not None:
+            self.scheduler.update(self.trains, dt)
+        elif self.kinematics is not None and not self.moving_block:  # Moving block looks ahead train by train
+            self.kinematics.update(self.trains, dt)
+        else:
+            [train.update(dt) for train in self.trains]
+        [trader.update(dt) for trader in self.traders]
+
+    def run(self, ticks):
+        for tick in xrange(ticks):
+            self.step(self.timestep)
+
+    def close(self):  # Stop the worker processes, if there are any
+        if self.batch_replanner is not None:
+            self.batch_replanner.close()
+
+    def settle(self):  # Bring every train's position up to date, which event driven trains only have at events
+        if self.scheduler is not None:
+            self.scheduler.settle()
+
+    def updateSignals(self, block):  # Lights that guard block are red while it is occupied
+        for signal, light in block.guards:
+            if getattr(signal, light) is not None:  # If there is a light in that direction
+                green = not block.isOccupied()
+                if self.scheduler is not None and getattr(signal, light) != green:
+                    self.scheduler.wakeSignal(signal)
+                setattr(signal, light, green)
+                self.signal_evaluations += 1
+
+    def replanTrains(self, trains):
+        if self.async_replanner is not None:
+            for train in trains:
+                self.async_replanner.request(train, self.graph)
+        elif self.batch_replanner is not None and len(trains) >= self.batch_replanner.min_trains:
+            self.batch_replanner.replan(self.graph, trains, self.pathfinder)
+        else:
+            for train in trains:
+                train.newPath(self.pathfinder.getPath(train))
+        for train in trains:
+            train.dirty = False
+        if self.scheduler is not None:
+            self.scheduler.wakeAll(trains)
+
+    def createTrader(self, x, y, produces, consumes):
+        trader = Trader(self.next_trader_id, x, y, produces, consumes)
+        self.traders.append(trader)
+        self.trader_index.add(trader)
+        self.next_trader_id += 1
+        for station in self.graph.node_index.getWithin(x, y, Station.reach, lambda node: node.type is Station.type):
+            self.connect(trader, station)
+
+    def deleteTrader(self, trader):
+        if trader.delete:
+            return
+        trader.delete = True
+        self.trader_index.remove(trader)
+        self.traders.remove(trader)
+        for station in trader.connections:
+            station.connections.remove(trader)
+        trader.connections = []
+
+    def connect(self, trader, station):
+        if trader not in station.connections:  # A station made in the same tick as the trader is already connected
+            station.connections.append(trader)
+            trader.connections.append(station)
+
+    def updateConnections(self):
+        # Keep Trader.connections and Station.connections up to date with the stations in the graph. Traders connect
+        # themselves when they are created or deleted.
+        changes = self.connection_changes.read()
+        if changes is None:
+            for trader in self.traders:
+                trader.connections = []
+            for station in self.graph.nodes:
+                if station.type is Station.type:
+                    station.connections = []
+                    self.connectStation(station)
+            return
+
+        for change in changes:
+            if isinstance(change, NodeAdded) and change.node.type is Station.type:
+                self.connectStation(change.node)
+            elif isinstance(change, NodeRemoved) and change.node.type is Station.type:
+                station = change.node
+                for trader in station.connections:
+                    trader.connections.remove(station)
+                station.connections = []
+
+    def connectStation(self, station):
+        for trader in self.trader_index.getWithin(station.x, station.y, Station.reach):
+            self.connect(trader, station)
@@ -0,0 +1,118 @@
+class Change(object):
+    # One entry in a Journal. nodes are the nodes whose nbors (or existence) the change affected. Structural changes
+    # bump Graph.version and go in Graph.journal, the others in Graph.traffic.
+    __slots__ = ()
+    structural = True
+    nodes = ()
+
+
+class NodeAdded(Change):
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+    @property
+    def nodes(self):
+        return (self.node,)
+
+
+class NodeRemoved(Change):
+    __slots__ = ('node', 'nbors')
+
+    def __init__(self, node, nbors):
+        self.node, self.nbors = node, nbors
+
+    @property
+    def nodes(self):
+        return (self.node,) + self.nbors
+
+
+class NodeReplaced(Change):  # Follows the NodeAdded, EdgeAdded and NodeRemoved changes that did the replacing
+    __slots__ = ('old', 'new')
+
+    def __init__(self, old, new):
+        self.old, self.new = old, new
+
+    @property
+    def nodes(self):
+        return (self.old, self.new)
+
+
+class EdgeChange(Change):
+    __slots__ = ('from_', 'to')
+
+    def __init__(self, from_, to):
+        self.from_, self.to = from_, to
+
+    @property
+    def nodes(self):
+        return (self.from_, self.to)
+
+
+class EdgeAdded(EdgeChange):
+    __slots__ = ()
+
+
+class EdgeRemoved(EdgeChange):
+    __slots__ = ()
+
+
+class OccupancyChanged(Change):  # An edge became busy, or stopped being busy
+    __slots__ = ('edge',)
+    structural = False
+
+    def __init__(self, edge):
+        self.edge = edge
+
+
+class SignalToggled(Change):  # The lights a signal has changed
+    __slots__ = ('signal',)
+    structural = False
+
+    def __init__(self, signal):
+        self.signal = signal
+
+
+def changedNodes(changes):
+    nodes = set()
+    for change in changes:
+        nodes.update(change.nodes)
+    return nodes
+
+
+class Journal(object):
+    # Log of the changes made to a Graph, read by every consumer at its own pace through its own Cursor. Only the
+    # last size entries are guaranteed to be kept; a cursor that falls further behind than that reads None, and its
+    # consumer has to start over from the graph as it is. A Graph keeps the changes that come every tick in a journal
+    # of their own, so that they don't push out the structural changes that consumers only read when there are some.
+    size = 4096
+
+    def __init__(self):
+        self.entries = []
+        self.start = 0  # Position of entries[0]
+
+    def append(self, change):
+        self.entries.append(change)
+        if len(self.entries) > 2 * self.size:  # Trim in bulk, not on every append
+            dropped = len(self.entries) - self.size
+            del self.entries[:dropped]
+            self.start += dropped
+
+    def getEnd(self):
+        return self.start + len(self.entries)
+
+    def cursor(self, behind=False):  # A cursor made behind reads None first, i.e. starts over
+        return Cursor(self, -1 if behind else self.getEnd())
+
+
+class Cursor(object):
+    def __init__(self, journal, position):
+        self.journal, self.position = journal, position
+
+    def read(self):  # The changes since the last read, or None if some of them were dropped from the journal
+        journal = self.journal
+        position, self.position = self.position, journal.getEnd()
+        if position < journal.start:
+            return None
+        return journal.entries[position - journal.start:]
@@ -0,0 +1,98 @@
+try:  # Optional, trains move one by one without it
+    import numpy
+except ImportError:
+    numpy = None
+import utils
+
+
+class Kinematics(object):
+    # The trains' motion along their edges, in struct of arrays form: one row per train, with the train's pos and
+    # speed, and the ends and length of its edge. Each tick every row advances at once. A train that would reach the
+    # end of its edge, where it may have to stop for a signal, move on to the next edge or turn around, moves one by
+    # one with Train.updateCoords instead, and so do the wagons of trains that are not all on the train's edge. A row
+    # is made again when its train, or the train's start or end, changes.
+
+    def __init__(self):
+        self.trains = []
+
+    def build(self, trains):
+        count = len(trains)
+        self.trains = list(trains)
+        self.starts, self.ends = [None] * count, [None] * count
+        self.moving = numpy.zeros(count, dtype=bool)
+        self.forward = numpy.zeros(count, dtype=bool)  # Whether going from lnode to hnode
+        self.pos = numpy.zeros(count)
+        self.speeds = numpy.zeros(count)
+        self.lengths = numpy.ones(count)
+        self.start_xs, self.start_ys = numpy.zeros(count), numpy.zeros(count)
+        self.end_xs, self.end_ys = numpy.zeros(count), numpy.zeros(count)
+        # Distance from the train to each of its wagons, in a column per wagon
+        self.wagon_offsets = numpy.zeros((count, 0))
+        self.has_wagons = numpy.zeros((count, 0), dtype=bool)
+        for row, train in enumerate(trains):
+            self.refresh(row, train)
+
+    def refresh(self, row, train):
+        missing = len(train.wagons) - self.wagon_offsets.shape[1]
+        if missing > 0:  # More wagons than any train so far
+            self.wagon_offsets = numpy.hstack((self.wagon_offsets, numpy.zeros((len(self.trains), missing))))
+            self.has_wagons = numpy.hstack((self.has_wagons, numpy.zeros((len(self.trains), missing), dtype=bool)))
+        self.trains[row] = train
+        self.starts[row], self.ends[row] = train.start, train.end
+        self.moving[row] = train.start is not train.end
+        self.pos[row] = train.pos
+        self.speeds[row] = train.speed
+        self.has_wagons[row] = False
+        offset = 0
+        for column, wagon in enumerate(train.wagons):
+            offset += wagon.size  # Added up in the same order as Train.updateWagons, for the very same floats
+            self.wagon_offsets[row, column] = offset
+            self.has_wagons[row, column] = True
+        if self.moving[row]:
+            self.forward[row] = train.start is train.edge.lnode
+            self.lengths[row] = train.edge.length
+            self.start_xs[row], self.start_ys[row] = train.start.x, train.start.y
+            self.end_xs[row], self.end_ys[row] = train.end.x, train.end.y
+
+    def update(self, trains, dt):
+        if len(trains) != len(self.trains):
+            self.build(trains)
+        for row, train in enumerate(trains):
+            if train is not self.trains[row] or train.start is not self.starts[row] or train.end is not self.ends[row]:
+                self.refresh(row, train)
+
+        # Same operations, in the same order, as Train.updateCoords and Train.updateWagons, so that both give the
+        # very same positions
+        pos = self.pos + (self.speeds * dt) / self.lengths
+        slow = self.moving & (pos >= 1)
+        bulk = self.moving & ~slow
+        xs, ys = utils.getPointsAlongLines(self.start_xs, self.start_ys, self.end_xs, self.end_ys, pos)
+        offsets = numpy.where(self.forward, pos * self.lengths, (1 - pos) * self.lengths)
+        wagon_pos = (1 - pos)[:, None] + self.wagon_offsets / self.lengths[:, None]  # Going back from end to start
+        wagon_xs, wagon_ys = utils.getPointsAlongLines(self.end_xs[:, None], self.end_ys[:, None],
+                                                       self.start_xs[:, None], self.start_ys[:, None], wagon_pos)
+        wagon_offsets = numpy.where(self.forward[:, None], (1 - wagon_pos) * self.lengths[:, None],
+                                    wagon_pos * self.lengths[:, None])
+        on_edge = (wagon_pos <= 1) | ~self.has_wagons  # Whether each wagon is on the train's edge
+        self.pos[bulk] = pos[bulk]
+
+        rows = numpy.flatnonzero(bulk).tolist()
+        for row, train_pos, x, y, offset, wagons_on_edge, wagons_xs, wagons_ys, wagons_offsets in zip(
+                rows, pos[bulk].tolist(), xs[bulk].tolist(), ys[bulk].tolist(), offsets[bulk].tolist(),
+                on_edge[bulk].all(axis=1).tolist(), wagon_xs[bulk].tolist(), wagon_ys[bulk].tolist(),
+                wagon_offsets[bulk].tolist()):
+            train = trains[row]
+            train.pos, train.x, train.y = train_pos, x, y
+            edge = train.edge
+            edge.moveOccupant(train, offset)
+            if wagons_on_edge and all(wagon.edge is edge for wagon in train.wagons):
+                for wagon, wagon_x, wagon_y, wagon_offset in zip(train.wagons, wagons_xs, wagons_ys, wagons_offsets):
+                    wagon.x, wagon.y = wagon_x, wagon_y
+                    edge.moveOccupant(wagon, wagon_offset)
+            else:
+                train.updateWagons()
+
+        for row in numpy.flatnonzero(slow).tolist():  # In list order, since they may share a station's cargo
+            train = trains[row]
+            train.updateCoords(dt)
+            self.refresh(row, train)
@@ -0,0 +1,55 @@
+from collections import defaultdict
+import sys
+
+# What each entity owns, on top of the object itself: containers and numbers that no other object shares. What is in
+# the containers is counted too, down to the entities they reference, which are counted on their own, not again here.
+owned_attributes = {
+    'Node': ('x', 'y', 'nbors', 'edges'),
+    'Station': ('x', 'y', 'nbors', 'edges', 'resources', 'connections'),
+    'Signal': ('x', 'y', 'nbors', 'edges'),
+    'Edge': ('length', 'busy', 'offsets'),
+    'Train': ('pos', 'x', 'y', 'path', 'wagons', 'trail'),
+    'Wagon': ('x', 'y', 'cargo'),
+}
+entity_names = set(owned_attributes) | set(['Trader'])
+shared = (None, True, False, ())  # The one of each that everything refers to
+
+
+def getSize(value):  # Bytes used by value and what is in it, but for entities and shared values
+    if any(value is other for other in shared) or type(value).__name__ in entity_names:
+        return 0
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(getSize(key) + getSize(item) for key, item in value.iteritems())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(getSize(item) for item in value)
+    elif hasattr(type(value), '__slots__'):  # A helper object, i.e. a Trail
+        size += sum(getSize(getattr(value, name)) for name in type(value).__slots__ if hasattr(value, name))
+    return size
+
+
+def getFootprint(entity):  # Bytes used by entity and what it owns
+    size = sys.getsizeof(entity)
+    for attribute in owned_attributes.get(type(entity).__name__, ()):
+        size += getSize(getattr(entity, attribute))
+    return size
+
+
+def getMemoryReport(graph, trains):
+    # Returns {entity type name: (count, total bytes, bytes per entity)} for everything in graph and trains
+    counts, totals = defaultdict(int), defaultdict(int)
+    entities = [graph.nodes, graph.edges.itervalues(), trains, (wagon for train in trains for wagon in train.wagons)]
+    for group in entities:
+        for entity in group:
+            name = type(entity).__name__
+            counts[name] += 1
+            totals[name] += getFootprint(entity)
+    return dict((name, (counts[name], totals[name], totals[name] / float(counts[name]))) for name in counts)
+
+
+def printMemoryReport(graph, trains):
+    report = getMemoryReport(graph, trains)
+    print "%-10s %10s %14s %10s" % ("Entity", "Count", "Bytes", "Per item")
+    for name in sorted(report):
+        count, total, each = report[name]
+        print "%-10s %10d %14d %10.1f" % (name, count, total, each)
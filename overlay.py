@@ -0,0 +1,243 @@
+from collections import defaultdict
+from journal import changedNodes
+from pathfinding import NodeHeap, HeapBoy
+import utils
+
+
+class Corridor(object):
+    # A chain of track between two junctions. nodes runs from one junction to the other (they may be the same node),
+    # every node in between has exactly two nbors, and offsets holds the distance from nodes[0] to each node.
+    __slots__ = ('nodes', 'offsets', 'length')
+
+    def __init__(self, nodes, offsets):
+        self.nodes, self.offsets = nodes, offsets
+        self.length = offsets[-1]
+
+    def walk(self, node):  # The nodes passed when leaving the corridor end node, in order
+        if self.nodes[0] is node:
+            return self.nodes[1:]
+        return self.nodes[-2::-1]
+
+
+class CorridorOverlay(object):
+    # Graph of junctions connected by corridors. A node is a junction if it doesn't have exactly two nbors, or if
+    # its type is one of junction_types (i.e. stations, which must stay visible to searches). Everything else is
+    # collapsed into the corridor running through it.
+
+    def __init__(self, graph, junction_types=()):
+        self.graph = graph
+        self.junction_types = junction_types
+        self.corridors_at = defaultdict(list)  # junction -> corridors ending at it
+        self.corridor_of = {}  # node inside a corridor -> corridor
+        self.rings = set()  # Nodes made junctions to break up loops without any junction
+        for node in graph.nodes:
+            self.addCorridorsAround(node)
+
+    def isJunction(self, node):
+        return len(node.nbors) != 2 or node.type in self.junction_types or node in self.rings
+
+    def corridors(self, node):
+        if node in self.corridor_of:
+            return [self.corridor_of[node]]
+        return self.corridors_at.get(node, [])
+
+    def addCorridorsAround(self, node):
+        added = []
+        if not self.isJunction(node):
+            if node in self.corridor_of:
+                return added
+            # Find a junction to start from by following the chain one way
+            last_node, current_node = node, node.nbors[0]
+            while not self.isJunction(current_node):
+                if current_node is node:  # Came all the way around, no junction on this loop
+                    self.rings.add(node)
+                    break
+                last_node, current_node = current_node, (current_node.nbors[0]
+                                                         if current_node.nbors[0] is not last_node
+                                                         else current_node.nbors[1])
+            node = current_node
+
+        for nbor in node.nbors:
+            if nbor in self.corridor_of:
+                continue
+            if self.isJunction(nbor) and any(nbor is corridor.nodes[-1] or nbor is corridor.nodes[0]
+                                             for corridor in self.corridors_at.get(node, ())
+                                             if len(corridor.nodes) == 2):
+                continue  # Junctions right next to each other, and already connected
+            nodes, offsets = [node, nbor], [0, self.graph.getEdge(node, nbor).length]
+            while not self.isJunction(nodes[-1]):
+                last_node, current_node = nodes[-2], nodes[-1]
+                next_node = current_node.nbors[0] if current_node.nbors[0] is not last_node else current_node.nbors[1]
+                offsets.append(offsets[-1] + self.graph.getEdge(current_node, next_node).length)
+                nodes.append(next_node)
+            corridor = Corridor(nodes, offsets)
+            for inner_node in nodes[1:-1]:
+                self.corridor_of[inner_node] = corridor
+            self.corridors_at[nodes[0]].append(corridor)
+            if nodes[-1] is not nodes[0]:
+                self.corridors_at[nodes[-1]].append(corridor)
+            added.append(corridor)
+        return added
+
+    def removeCorridor(self, corridor):
+        for inner_node in corridor.nodes[1:-1]:
+            if self.corridor_of.get(inner_node) is corridor:
+                del self.corridor_of[inner_node]
+        for end in (corridor.nodes[0], corridor.nodes[-1]):
+            corridors = self.corridors_at.get(end)
+            if corridors is not None and corridor in corridors:
+                corridors.remove(corridor)
+                if not corridors:
+                    del self.corridors_at[end]
+
+    def graphChanged(self, nodes):
+        # Rebuild the corridors running through or ending at the changed nodes. Returns the junctions at the ends of
+        # the old and new corridors, i.e. every junction a search could see change.
+        affected = set(nodes)
+        removed = set()
+        for node in nodes:
+            self.rings.discard(node)
+            removed.update(self.corridors(node))
+        for corridor in removed:
+            self.removeCorridor(corridor)
+            affected.update(corridor.nodes)
+        junctions = set()
+        for corridor in removed:
+            junctions.update((corridor.nodes[0], corridor.nodes[-1]))
+        for node in affected:
+            for corridor in self.addCorridorsAround(node):
+                junctions.update((corridor.nodes[0], corridor.nodes[-1]))
+        return junctions
+
+
+class OverlayBoy(object):
+    # A* over a CorridorOverlay, so that a train crosses a whole corridor in one expansion. Paths are expanded back
+    # into plain nodes, the one-way rule still applies, and the goal is only accepted once it is expanded, since one
+    # overlay step can be long. Destinations inside corridors are left to HeapBoy.
+
+    def __init__(self, graph, junction_types=()):
+        self.junction_types = junction_types
+        self.fallback = HeapBoy(graph)
+        self.graph = graph
+
+    class DataItem(object):
+        __slots__ = ('parent', 'via', 'g', 'h')  # via is the corridor taken from parent, or the nodes of a first leg
+
+        def __init__(self, parent, via, g, h):
+            self.parent, self.via, self.g, self.h = parent, via, g, h
+
+    def getGraph(self):
+        return self.fallback.graph
+
+    def setGraph(self, graph):  # A new graph (i.e. a loaded game) gets a new overlay
+        self.fallback.graph = graph
+        self.overlay = CorridorOverlay(graph, self.junction_types)
+        self.version = graph.version
+        self.changes = graph.journal.cursor()
+    graph = property(getGraph, setGraph)
+
+    def getPath(self, train):
+        return self.findPath(train.start, train.end, train.destination)
+
+    def isStale(self, train):
+        return True
+
+    def findPath(self, start, end, destination):
+        return self.search(start, end, destination)[0]
+
+    def graphChanged(self, nodes):
+        junctions = self.overlay.graphChanged(nodes)
+        junctions.update(nodes)
+        self.version = self.graph.version
+        return junctions
+
+    def sync(self):
+        if self.version != self.graph.version:
+            changes = self.changes.read()
+            if changes is None:  # Fell behind the journal, start over
+                self.graph = self.graph
+            else:
+                self.graphChanged(changedNodes(changes))
+
+    def search(self, start, end, destination):
+        # Returns (path, touched) like HeapBoy.search, with touched being the junctions the search looked at
+        self.sync()
+        overlay = self.overlay
+        if end is destination:
+            return [end], set([start, end])
+        if destination in end.nbors:  # Same goal-on-sight rule as HeapBoy
+            return [destination], set([start, end, destination])
+        if not self.graph.components.connected(end, destination):
+            return [], set([start, end, destination])
+        if not overlay.isJunction(destination):
+            return self.fallback.search(start, end, destination)
+
+        dest_pos = (destination.x, destination.y)
+        node_data = {}
+        open_heap = NodeHeap()
+        seq = 0
+
+        # First steps: from end to the junction(s) of its corridor(s), but not back towards start (one-way rule)
+        first_steps = []
+        own_corridor = overlay.corridor_of.get(end)  # Can't be entered again later without passing end
+        if own_corridor is not None:
+            corridor = own_corridor
+            idx = corridor.nodes.index(end)
+            if corridor.nodes[idx - 1] is not start:
+                first_steps.append((corridor.nodes[0], corridor.nodes[idx - 1::-1], corridor.offsets[idx]))
+            if corridor.nodes[idx + 1] is not start:
+                first_steps.append((corridor.nodes[-1], corridor.nodes[idx + 1:],
+                                    corridor.length - corridor.offsets[idx]))
+        else:
+            node_data[end] = self.DataItem(None, None, 0, 0)
+            for corridor in overlay.corridors_at.get(end, ()):
+                walk = corridor.walk(end)
+                if walk[0] is not start and walk[-1] is not end:
+                    first_steps.append((walk[-1], corridor, corridor.length))
+
+        for junction, via, g in first_steps:
+            seq -= 1
+            data = node_data.get(junction)
+            if data is None:
+                data = node_data[junction] = self.DataItem(end, via, g, utils.getDistance(dest_pos,
+                                                                                         (junction.x, junction.y)))
+                open_heap.push(junction, (g + data.h, seq))
+            elif g < data.g:
+                data.g, data.parent, data.via = g, end, via
+                open_heap.decreaseKey(junction, (g + data.h, seq))
+
+        closed = set([end])
+        while open_heap:
+            current_node = open_heap.pop()
+            if current_node is destination:
+                return self.expandPath(end, destination, node_data), set(node_data) | set([start, end])
+            closed.add(current_node)
+            current_data = node_data[current_node]
+            for corridor in overlay.corridors_at.get(current_node, ()):
+                nbor = corridor.nodes[-1] if corridor.nodes[0] is current_node else corridor.nodes[0]
+                if nbor in closed or corridor is own_corridor:
+                    continue
+                seq -= 1
+                g = current_data.g + corridor.length
+                data = node_data.get(nbor)
+                if data is None:
+                    data = node_data[nbor] = self.DataItem(current_node, corridor, g,
+                                                           utils.getDistance(dest_pos, (nbor.x, nbor.y)))
+                    open_heap.push(nbor, (g + data.h, seq))
+                elif g < data.g:
+                    data.g, data.parent, data.via = g, current_node, corridor
+                    open_heap.decreaseKey(nbor, (g + data.h, seq))
+
+        return [], set(node_data) | set([start, end])
+
+    def expandPath(self, end, destination, node_data):
+        legs = []
+        node = destination
+        while node is not end:
+            data = node_data[node]
+            legs.append(data.via if isinstance(data.via, list) else data.via.walk(data.parent))
+            node = data.parent
+        path = []
+        for leg in reversed(legs):
+            path.extend(leg)
+        return path
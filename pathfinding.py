@@ -0,0 +1,524 @@
+from collections import defaultdict, OrderedDict
+from operator import attrgetter
+from journal import changedNodes
+import utils
+
+
+class NodeHeap(object):
+    # Binary min-heap of nodes with decrease-key. Keys are compared as tuples, and the position of every queued
+    # node is kept in a dict so that a node can be found and moved up the heap without scanning.
+
+    def __init__(self):
+        self.heap = []
+        self.keys = {}
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, node):
+        return node in self.positions
+
+    def push(self, node, key):
+        self.keys[node] = key
+        self.positions[node] = len(self.heap)
+        self.heap.append(node)
+        self.siftUp(len(self.heap) - 1)
+
+    def decreaseKey(self, node, key):
+        self.keys[node] = key
+        self.siftUp(self.positions[node])
+
+    def update(self, node, key):  # Push, or move the node up or down to match its new key
+        if node not in self.positions:
+            self.push(node, key)
+        elif key < self.keys[node]:
+            self.decreaseKey(node, key)
+        else:
+            self.keys[node] = key
+            self.siftDown(self.positions[node])
+
+    def remove(self, node):
+        idx = self.positions.pop(node)
+        del self.keys[node]
+        last = self.heap.pop()
+        if idx < len(self.heap):
+            self.heap[idx] = last
+            self.positions[last] = idx
+            self.siftDown(idx)
+            self.siftUp(self.positions[last])
+
+    def topKey(self):
+        return self.keys[self.heap[0]] if self.heap else None
+
+    def pop(self):
+        heap = self.heap
+        node = heap[0]
+        last = heap.pop()
+        del self.positions[node]
+        del self.keys[node]
+        if heap:
+            heap[0] = last
+            self.positions[last] = 0
+            self.siftDown(0)
+        return node
+
+    def siftUp(self, idx):
+        heap, keys, positions = self.heap, self.keys, self.positions
+        node = heap[idx]
+        key = keys[node]
+        while idx > 0:
+            parent_idx = (idx - 1) >> 1
+            parent = heap[parent_idx]
+            if key >= keys[parent]:
+                break
+            heap[idx] = parent
+            positions[parent] = idx
+            idx = parent_idx
+        heap[idx] = node
+        positions[node] = idx
+
+    def siftDown(self, idx):
+        heap, keys, positions = self.heap, self.keys, self.positions
+        size = len(heap)
+        node = heap[idx]
+        key = keys[node]
+        while True:
+            child_idx = 2 * idx + 1
+            if child_idx >= size:
+                break
+            if child_idx + 1 < size and keys[heap[child_idx + 1]] < keys[heap[child_idx]]:
+                child_idx += 1
+            child = heap[child_idx]
+            if keys[child] >= key:
+                break
+            heap[idx] = child
+            positions[child] = idx
+            idx = child_idx
+        heap[idx] = node
+        positions[node] = idx
+
+
+class HeapBoy(object):
+    # A* over Graph with the same rules as SoberBoy: the goal is accepted as soon as it is seen as a neighbour, and
+    # a train may not leave its current node the way it came (the one-way rule). The open list is a NodeHeap, the
+    # closed list a set, and node records only live for the duration of one search. With landmarks, the heuristic
+    # is tightened with Landmarks' distance bounds.
+
+    def __init__(self, graph, landmarks=None):
+        self.graph = graph
+        self.landmarks = landmarks
+
+    class DataItem(object):
+        __slots__ = ('parent', 'g', 'h')
+
+        def __init__(self, parent, g, h):
+            self.parent = parent
+            self.g = g
+            self.h = h
+
+    def getPath(self, train):
+        return self.findPath(train.start, train.end, train.destination)
+
+    def isStale(self, train):  # Without a cache every path has to be recalculated after a graph change
+        return True
+
+    def graphChanged(self, nodes):  # Returns the nodes whose change may alter the result of a search
+        return nodes
+
+    def findPath(self, start, end, destination, estimate=None):
+        return self.search(start, end, destination, estimate)[0]
+
+    def search(self, start, end, destination, estimate=None):
+        # Returns (path, touched), where touched holds every node the search looked at. A graph change that involves
+        # none of the touched nodes can not change the result of the search. estimate(node) replaces the straight
+        # line distance to the destination as heuristic, and must never overestimate.
+        if end is destination:
+            return [end], set([start, end])
+        if not self.graph.components.connected(end, destination):
+            return [], set([start, end, destination])  # Would search all of end's component for nothing
+        if estimate is None and self.landmarks is not None:
+            estimate = self.landmarks.estimator(self.graph, destination)
+
+        dest_pos = (destination.x, destination.y)
+        node_data = {end: self.DataItem(None, 0, 0)}
+        open_heap = NodeHeap()
+        closed = set()
+        seq = 0  # Ties on f are broken in favour of the most recently seen node, like SoberBoy's sorted open list
+        current_node = end
+        last_node = start  # For one-way rule
+        while True:
+            current_data = node_data[current_node]
+            for nbor in current_node.nbors:
+                if nbor is destination:
+                    path = [nbor]
+                    node = current_node
+                    while node is not end:
+                        path.append(node)
+                        node = node_data[node].parent
+                    path.reverse()
+                    touched = set(node_data)
+                    touched.update((start, destination))
+                    return path, touched
+
+                if nbor is last_node or nbor in closed:  # Enforce one-way rule (nbor is last_node)
+                    continue
+
+                seq -= 1
+                g = current_data.g + self.graph.getEdge(current_node, nbor).length
+                data = node_data.get(nbor)
+                if data is None:
+                    h = utils.getDistance(dest_pos, (nbor.x, nbor.y)) if estimate is None else estimate(nbor)
+                    data = node_data[nbor] = self.DataItem(current_node, g, h)
+                    open_heap.push(nbor, (g + data.h, seq))
+                else:
+                    if g < data.g:
+                        data.g = g
+                        data.parent = current_node
+                    open_heap.decreaseKey(nbor, (data.g + data.h, seq))
+
+            closed.add(current_node)
+            last_node = current_node
+
+            if not open_heap:
+                touched = set(node_data)
+                touched.add(start)
+                return [], touched
+
+            current_node = open_heap.pop()
+
+
+class PathCache(object):
+    # Memoizes the paths of a pathfinder by (start, end, destination), i.e. by the edge and direction a train is on
+    # and where it is heading. Every entry is stamped with the graph version it was calculated at and indexed by the
+    # nodes its search touched, so that a graph change only drops the entries it could affect.
+
+    class Entry(object):
+        __slots__ = ('version', 'path', 'touched')
+
+        def __init__(self, version, path, touched):
+            self.version, self.path, self.touched = version, path, touched
+
+    def __init__(self, pathfinder):
+        self.pathfinder = pathfinder
+        self.reset()
+
+    def reset(self):
+        self.version = self.pathfinder.graph.version
+        self.changes = self.pathfinder.graph.journal.cursor()
+        self.entries = {}
+        self.entries_by_node = defaultdict(set)
+        self.unreachable = set()  # Keys of empty paths, which a new connection anywhere could make reachable
+        self.merges = self.pathfinder.graph.components.merges
+        self.train_entries = {}  # train -> (key, version) of the entry its current path came from
+
+    def getGraph(self):
+        return self.pathfinder.graph
+
+    def setGraph(self, graph):  # A new graph (i.e. a loaded game) invalidates everything
+        self.pathfinder.graph = graph
+        self.reset()
+    graph = property(getGraph, setGraph)
+
+    def getPath(self, train):
+        key = (train.start, train.end, train.destination)
+        entry = self.lookup(key)
+        self.train_entries[train] = (key, entry.version)
+        return entry.path[:]  # Trains consume their paths
+
+    def findPath(self, start, end, destination):
+        return self.lookup((start, end, destination)).path[:]
+
+    def addPath(self, train, path, touched):  # Take a path that was searched elsewhere, i.e. by a BatchReplanner
+        self.sync()
+        key = (train.start, train.end, train.destination)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.insert(key, path, touched)
+        self.train_entries[train] = (key, entry.version)
+
+    def isStale(self, train):
+        self.sync()
+        key, version = self.train_entries.get(train, (None, None))
+        entry = self.entries.get(key)
+        return entry is None or entry.version != version
+
+    def lookup(self, key):
+        self.sync()
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.insert(key, *self.pathfinder.search(*key))
+        return entry
+
+    def insert(self, key, path, touched):
+        entry = self.entries[key] = self.Entry(self.version, path, touched)
+        for node in touched:
+            self.entries_by_node[node].add(key)
+        if not path:
+            self.unreachable.add(key)
+        return entry
+
+    def sync(self):
+        graph = self.pathfinder.graph
+        if self.version != graph.version:
+            changes = self.changes.read()
+            if changes is None:  # Fell behind the journal, start over
+                self.graph = graph
+                return
+            self.invalidate(self.pathfinder.graphChanged(changedNodes(changes)))
+            self.version = graph.version
+            if self.merges != graph.components.merges:
+                self.merges = graph.components.merges
+                for key in list(self.unreachable):
+                    self.remove(key)
+
+    def invalidate(self, nodes):
+        for node in nodes:
+            for key in list(self.entries_by_node.get(node, ())):
+                self.remove(key)
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.unreachable.discard(key)
+        for node in entry.touched:
+            keys = self.entries_by_node.get(node)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.entries_by_node[node]
+
+
+class PathPreview(object):
+    # The path a tool shows between two nodes, kept until either node or the graph changes
+
+    def __init__(self):
+        self.key = None
+        self.path = None
+
+    def getPath(self, pathfinder, origin, destination):
+        graph = pathfinder.graph
+        key = (origin, destination, graph, graph.version)
+        if key != self.key:
+            self.key = key
+            self.path = pathfinder.findPath(origin, origin, destination)
+        return self.path
+
+
+INFINITY = float('inf')
+
+
+class DistanceTree(object):
+    # Shortest distances from every node to one destination, kept up to date with Lifelong Planning A* (with a zero
+    # heuristic, since the tree is shared by trains starting anywhere). Distances are only settled as far as queries
+    # need them, and a graph change only re-opens the nodes whose distance it affected.
+
+    def __init__(self, graph, destination):
+        self.graph = graph
+        self.destination = destination
+        self.g = {}
+        self.rhs = {destination: 0}
+        self.queue = NodeHeap()
+        self.queue.push(destination, 0)
+
+    def getDistance(self, node):  # Settle the distance to node, and return it
+        g, rhs, queue = self.g, self.rhs, self.queue
+        while queue and (queue.topKey() < min(g.get(node, INFINITY), rhs.get(node, INFINITY)) or
+                         g.get(node, INFINITY) != rhs.get(node, INFINITY)):
+            current_node = queue.pop()
+            if g.get(current_node, INFINITY) > rhs.get(current_node, INFINITY):
+                g[current_node] = rhs[current_node]
+            else:
+                g.pop(current_node, None)
+                self.updateNode(current_node)
+            for nbor in current_node.nbors:
+                self.updateNode(nbor)
+        return g.get(node, INFINITY)
+
+    def updateNode(self, node):
+        if node is not self.destination:
+            g, rhs = self.g.get, INFINITY
+            for nbor in node.nbors:
+                distance = self.graph.getEdge(node, nbor).length + g(nbor, INFINITY)
+                if distance < rhs:
+                    rhs = distance
+            if rhs == INFINITY:
+                self.rhs.pop(node, None)
+            else:
+                self.rhs[node] = rhs
+        node_g, node_rhs = self.g.get(node, INFINITY), self.rhs.get(node, INFINITY)
+        if node_g != node_rhs:
+            self.queue.update(node, min(node_g, node_rhs))
+        elif node in self.queue:
+            self.queue.remove(node)
+
+    def graphChanged(self, nodes):
+        for node in nodes:
+            self.updateNode(node)
+
+
+class IncrementalBoy(object):
+    # Incremental pathfinder. Paths are read off a DistanceTree per destination by walking downhill from the train,
+    # and the trees survive graph changes, which only repair the parts of them that the change affected. Trees are
+    # shared by all trains heading to the same destination; the least recently used ones are dropped.
+    max_trees = 64
+
+    def __init__(self, graph):
+        self.fallback = HeapBoy(graph)
+        self.graph = graph
+
+    def getGraph(self):
+        return self.fallback.graph
+
+    def setGraph(self, graph):  # A new graph (i.e. a loaded game) invalidates all trees
+        self.fallback.graph = graph
+        self.version = graph.version
+        self.changes = graph.journal.cursor()
+        self.trees = OrderedDict()
+    graph = property(getGraph, setGraph)
+
+    def getPath(self, train):
+        return self.findPath(train.start, train.end, train.destination)
+
+    def isStale(self, train):  # Reading a path off a repaired tree is cheap, so always do it
+        return True
+
+    def findPath(self, start, end, destination):
+        if end is destination:
+            return [end]
+        for nbor in end.nbors:  # Same goal-on-sight rule as HeapBoy
+            if nbor is destination:
+                return [nbor]
+        if not self.graph.components.connected(end, destination):
+            return []  # Don't grow a tree over all of end's component for nothing
+
+        tree = self.getTree(destination)
+        path = []
+        seen = set([end])
+        last_node, node = start, end
+        while node is not destination:
+            next_node, best = None, INFINITY
+            for nbor in node.nbors:
+                if nbor is last_node and node is end:  # Enforce one-way rule
+                    continue
+                distance = self.graph.getEdge(node, nbor).length + tree.getDistance(nbor)
+                if distance < best:
+                    next_node, best = nbor, distance
+            if next_node is None:
+                return []
+            if next_node in seen:
+                # The shortest way from here doubles back through the train's position, which the one-way rule
+                # forbids. Search instead, with the tree's distances as a (very good) heuristic.
+                return self.fallback.findPath(start, end, destination, tree.getDistance)
+            seen.add(next_node)
+            path.append(next_node)
+            last_node, node = node, next_node
+        return path
+
+    def getTree(self, destination):
+        self.sync()
+        tree = self.trees.pop(destination, None)
+        if tree is None:
+            tree = DistanceTree(self.graph, destination)
+            if len(self.trees) >= self.max_trees:
+                self.trees.popitem(last=False)
+        self.trees[destination] = tree
+        return tree
+
+    def graphChanged(self, nodes):
+        for tree in self.trees.values():
+            tree.graphChanged(nodes)
+        self.version = self.graph.version
+        return nodes
+
+    def sync(self):
+        if self.version != self.graph.version:
+            changes = self.changes.read()
+            if changes is None:  # Fell behind the journal, start over
+                self.graph = self.graph
+            else:
+                self.graphChanged(changedNodes(changes))
+
+
+class Landmarks(object):
+    # ALT heuristic: graph distances from a few landmark nodes, spread out over the map, bound the distance between
+    # any two nodes from below by the triangle inequality, |d(L, a) - d(L, b)| <= d(a, b). That is a much tighter
+    # bound than the straight line on winding track. The distances are DistanceTrees, so they are repaired rather
+    # than recalculated after graph changes. They are picked again once the candidates have changed by repick_share,
+    # or when a new candidate comes up while there are fewer than count, so that a growing map gets landmarks too.
+    repick_share = 0.25
+
+    def __init__(self, count=8, types=()):
+        self.count = count
+        self.types = types  # Node types to pick landmarks from, i.e. stations
+        self.graph = None
+
+    def reset(self, graph):
+        self.graph = graph
+        self.version = graph.version
+        self.changes = graph.journal.cursor()
+        self.trees = []
+        self.candidates = set(node for node in graph.nodes if node.type in self.types and node.nbors)
+        self.changed = set()  # Nodes that have become candidates since, or stopped being one
+        for landmark in self.pickLandmarks():
+            self.trees.append(DistanceTree(graph, landmark))
+
+    def pickLandmarks(self):
+        # Farthest point selection: start at the candidate farthest from the others' centre, then repeatedly take
+        # the candidate farthest from all landmarks picked so far
+        candidates = sorted(self.candidates, key=attrgetter('id'))
+        if not candidates:
+            return []
+        centre = (sum(node.x for node in candidates) / float(len(candidates)),
+                  sum(node.y for node in candidates) / float(len(candidates)))
+        landmarks = [max(candidates, key=lambda node: utils.getDistance(centre, (node.x, node.y)))]
+        closest = dict((node, utils.getNodeDistance(node, landmarks[0])) for node in candidates)
+        while len(landmarks) < min(self.count, len(candidates)):
+            landmark = max(candidates, key=closest.get)
+            if not closest[landmark]:
+                break
+            landmarks.append(landmark)
+            for node in candidates:
+                closest[node] = min(closest[node], utils.getNodeDistance(node, landmark))
+        return landmarks
+
+    def graphChanged(self, graph, nodes):
+        for tree in self.trees:
+            tree.graphChanged(nodes)
+        self.version = graph.version
+        for node in nodes:
+            if (node.type in self.types and bool(node.nbors)) != (node in self.candidates):
+                self.changed.add(node)
+            else:
+                self.changed.discard(node)
+        if any(not tree.destination.nbors for tree in self.trees):  # A landmark was deleted, pick new ones
+            self.reset(graph)
+        elif len(self.changed) > self.repick_share * len(self.candidates):
+            self.reset(graph)
+        elif len(self.trees) < self.count and any(node not in self.candidates for node in self.changed):
+            self.reset(graph)
+
+    def sync(self, graph):
+        if graph is not self.graph:
+            self.reset(graph)
+        elif self.version != graph.version:
+            changes = self.changes.read()
+            if changes is None:  # Fell behind the journal, start over
+                self.reset(graph)
+            else:
+                self.graphChanged(graph, changedNodes(changes))
+
+    def estimator(self, graph, destination):
+        # Returns estimate(node) for searches towards destination: the best of the landmark bounds and the straight
+        # line. A node a landmark reaches while the destination is out of its reach gets an infinite estimate.
+        self.sync(graph)
+        bounds = [(tree, tree.getDistance(destination)) for tree in self.trees]
+        dest_pos = (destination.x, destination.y)
+
+        def estimate(node):
+            best = utils.getDistance(dest_pos, (node.x, node.y))
+            for tree, to_destination in bounds:
+                bound = abs(to_destination - tree.getDistance(node))
+                if bound > best:  # inf - inf is nan, which never wins
+                    best = bound
+            return best
+        return estimate
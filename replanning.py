@@ -0,0 +1,150 @@
+from collections import defaultdict
+import cPickle
+import multiprocessing
+import os
+import Queue
+import tempfile
+import threading
+
+
+worker_path = None  # File the BatchReplanner leaves the graph in
+worker_graph = None
+worker_serial = None  # Which of the graphs left in the file worker_graph is
+
+
+def initWorker(path):
+    global worker_path
+    worker_path = path
+
+
+def solveGroup(task):
+    # Search every (start, end) of a group sharing a destination. Returns (path, touched) per train, as numbers. The
+    # graph is read from the file when the task is for a graph the worker doesn't have yet.
+    global worker_graph, worker_serial
+    serial, destination, trains = task
+    if serial != worker_serial:
+        with open(worker_path, 'rb') as f:
+            worker_graph, worker_serial = cPickle.load(f), serial
+    return [worker_graph.search(start, end, destination) for start, end in trains]
+
+
+class BatchReplanner(object):
+    # Replans many trains at once across a pool of worker processes. Trains are grouped by destination, the workers
+    # search the graph's CompactGraph, and the paths are installed with Train.newPath (and handed to the
+    # pathfinder's cache, if it has one). The pool is started on the first batch and kept until close(). The
+    # CompactGraph is pickled to a file once for every version of the graph, which the workers read when a task is
+    # for a version they don't have; tasks themselves only carry numbers. Below min_trains a batch isn't worth
+    # sending out, and the caller should replan serially.
+    min_trains = 64
+
+    def __init__(self, processes=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.pool = self.path = None
+        self.compact = None  # The CompactGraph in the file
+        self.serial = 0
+
+    def replan(self, graph, trains, pathfinder):
+        compact = graph.getCompact()
+        number = compact.number
+        groups = defaultdict(list)
+        for train in trains:
+            if number(train.start) >= 0 and number(train.end) >= 0 and number(train.destination) >= 0 and \
+                    graph.components.connected(train.end, train.destination):
+                groups[train.destination].append(train)
+            else:  # Left on a deleted node, which the CompactGraph doesn't have, or stranded, which is quick to tell
+                train.newPath(pathfinder.getPath(train))
+        destinations = list(groups)
+        if not destinations:
+            return
+        if self.pool is None:
+            fd, self.path = tempfile.mkstemp(prefix='compact', suffix='.pickle')
+            os.close(fd)
+            self.pool = multiprocessing.Pool(self.processes, initWorker, (self.path,))
+        if compact is not self.compact:  # No worker is reading the file, since map() waits for them all
+            with open(self.path, 'wb') as f:
+                cPickle.dump(compact, f, cPickle.HIGHEST_PROTOCOL)
+            self.compact = compact
+            self.serial += 1
+        tasks = [(self.serial, number(destination),
+                  [(number(train.start), number(train.end)) for train in groups[destination]])
+                 for destination in destinations]
+        results = self.pool.map(solveGroup, tasks)
+
+        nodes = compact.nodes
+        addPath = getattr(pathfinder, 'addPath', None)
+        for destination, group_results in zip(destinations, results):
+            for train, (path, touched) in zip(groups[destination], group_results):
+                path = [nodes[idx] for idx in path]
+                if addPath is not None:
+                    addPath(train, path, set(nodes[idx] for idx in touched))
+                train.newPath(path[:])
+
+    def close(self):  # Let the workers finish, and stop them
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            os.remove(self.path)
+            self.pool = self.path = self.compact = None
+
+
+class AsyncReplanner(object):
+    # Replans trains on a background thread, so that the tick requesting a path never waits for it. Trains keep
+    # following their old path in the meantime. A result is only applied if the graph is still at the version it was
+    # searched at; otherwise it is thrown away and the train is queued again. The search runs over the graph's
+    # CompactGraph, which a later change to the graph patches into a new copy, leaving the one searched as it was.
+
+    def __init__(self):
+        self.requests = Queue.Queue()
+        self.results = Queue.Queue()
+        self.pending = set()  # Trains with a request in flight
+        self.thread = None
+
+    def request(self, train, graph):
+        if train in self.pending:  # The result will be checked, and requested again if it is stale
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.work)
+            self.thread.daemon = True
+            self.thread.start()
+        self.pending.add(train)
+        self.requests.put((train, graph, graph.getCompact(), train.start, train.end, train.destination))
+
+    def work(self):
+        while True:
+            train, graph, compact, start, end, destination = self.requests.get()
+            nodes = compact.nodes
+            if end is destination:
+                path, touched = [end], set([start, end])
+            elif compact.number(end) >= 0 and compact.number(destination) >= 0:
+                path, touched = compact.search(compact.number(start), compact.number(end), compact.number(destination))
+                path = [nodes[idx] for idx in path]
+                touched = set(nodes[idx] for idx in touched if idx >= 0)
+                touched.add(start)
+            else:  # Left on a deleted node
+                path, touched = [], set([start, end, destination])
+            self.results.put((train, graph, compact.version, end, destination, path, touched))
+
+    def apply(self, graph, pathfinder):
+        # Hand finished paths to their trains, and return those trains. Called from the tick, on the thread that owns
+        # the graph.
+        applied = []
+        while True:
+            try:
+                train, result_graph, version, end, destination, path, touched = self.results.get_nowait()
+            except Queue.Empty:
+                break
+            self.pending.discard(train)
+            if result_graph is not graph or version != graph.version or destination is not train.destination:
+                self.request(train, graph)
+                continue
+            if train.end is not end:
+                # The train has moved on along its old path since. Use the rest of the new path if it is still on it.
+                if train.end not in path:
+                    self.request(train, graph)
+                    continue
+                path = path[path.index(train.end):]
+            elif hasattr(pathfinder, 'addPath'):
+                pathfinder.addPath(train, path, touched)
+            train.newPath(path[:])
+            applied.append(train)
+        return applied
@@ -0,0 +1,123 @@
+from collections import defaultdict
+from itertools import count
+import heapq
+import utils
+
+
+class Scheduler(object):
+    # Event driven train motion. Instead of every train every tick, a train is only updated in the ticks where
+    # something can happen to it: it or one of its wagons reaching the end of an edge, its cargo being done at a
+    # station, the lights of the signal it waits at changing, or a new path. Those times are kept in a heap. A train
+    # that waits for a light or a path isn't in the heap at all until it is woken. In between events, a train cruising
+    # along its edge is wherever its speed has taken it, and one at a station has the cargo its time there has moved,
+    # which settle() works out for whoever needs to know, like the GUI when drawing.
+    margin = 1e-9  # Events are this much early, so that rounding doesn't put them a tick late
+
+    def __init__(self):
+        self.time = 0.0
+        self.events = []  # (time, sequence number, train)
+        self.sequence = count()  # Orders events at the same time, so that trains are never compared
+        self.due = {}  # train -> time of its next event, None if it waits to be woken
+        self.cruising = {}  # Train moving along its edge -> time it was last moved up to
+        self.dwelling = {}  # Train working at its destination -> time its cargo was last transferred up to
+        self.waiting = defaultdict(set)  # Signal -> trains stopped at it
+        self.trains, self.order = None, {}  # train -> position in the engine's list, which they are updated in
+
+    def wake(self, train):  # Update train in the coming tick
+        self.due[train] = self.time
+        heapq.heappush(self.events, (self.time, next(self.sequence), train))
+
+    def wakeAll(self, trains):
+        for train in trains:
+            self.wake(train)
+
+    def wakeSignal(self, signal):  # Update the trains stopped at signal in the coming tick
+        for train in self.waiting.pop(signal, ()):
+            self.wake(train)
+
+    def update(self, trains, dt):
+        if trains is not self.trains or len(trains) != len(self.order):  # Trains were added, or replaced
+            self.follow(trains)
+        self.time += dt
+        due = set()
+        while self.events and self.events[0][0] <= self.time:
+            time, _, train = heapq.heappop(self.events)
+            if self.due.get(train) == time:
+                due.add(train)
+        for train in sorted(due, key=self.order.get):  # In list order, since they may share a station's cargo
+            self.updateTrain(train, dt)
+
+    def follow(self, trains):
+        self.trains = trains
+        self.order = dict((train, i) for i, train in enumerate(trains))
+        for states in (self.due, self.cruising, self.dwelling):
+            for train in [train for train in states if train not in self.order]:
+                del states[train]
+        for signal, waiting in self.waiting.items():
+            waiting.intersection_update(self.order)
+        self.wakeAll([train for train in trains if train not in self.due])
+
+    def updateTrain(self, train, dt):
+        # Bring train up to the start of this tick, then update it for this tick like Train.update does. A train at a
+        # station is updated for the whole time since it was last, instead.
+        start = self.time - dt
+        if train in self.cruising:
+            self.settleTrain(train, start)
+            del self.cruising[train]
+        elif train in self.dwelling:
+            since = self.dwelling.pop(train)
+            if not train.path and train.end is train.destination:  # All of its stay since in one go
+                dt = self.time - since
+        train.updateCoords(dt)
+        self.schedule(train)
+
+    def schedule(self, train):  # Work out when train needs updating next
+        self.due[train] = None
+        if train.start is train.end:  # No orders, until it gets a path
+            return
+        if train.pos >= 1:
+            if train.shouldStopForSignal():
+                self.waiting[train.end].add(train)
+            elif train.path:  # Onto the next edge in the coming tick
+                self.at(train, self.time)
+            elif train.end is train.destination:
+                self.dwelling[train] = self.time
+                self.at(train, self.time + train.getTransferTime(train.end))
+            return  # Otherwise there is no path to its goal, and it waits for one
+
+        # Until it reaches the end of its edge, or one of its wagons reaches the end of theirs
+        self.cruising[train] = self.time
+        distance = (1 - train.pos) * train.edge.length
+        offset = 0
+        for wagon in train.wagons:
+            offset += wagon.size
+            edge, _, _, pos, _ = train.getPointBehind(offset)
+            if edge is not train.edge:
+                distance = min(distance, pos * edge.length)
+        self.at(train, self.time + distance / train.speed - self.margin)
+
+    def at(self, train, time):
+        self.due[train] = time
+        heapq.heappush(self.events, (time, next(self.sequence), train))
+
+    def settle(self):  # Move every cruising train to where it is by now, and transfer the cargo of those at stations
+        for train in self.cruising:
+            self.settleTrain(train, self.time)
+        for train in sorted(self.dwelling, key=self.order.get):
+            self.settleCargo(train, self.time)
+
+    def settleTrain(self, train, time):  # Move train along its edge to where it is at time
+        since = self.cruising[train]
+        if time <= since:
+            return
+        train.pos += train.speed * (time - since) / train.edge.length
+        train.x, train.y = utils.getNodePointAlongLine(train.start, train.end, train.pos)
+        train.edge.moveOccupant(train, train.edge.getOffset(train.start, train.pos))
+        train.updateWagons()
+        self.cruising[train] = time
+
+    def settleCargo(self, train, time):  # Transfer the cargo that train has transferred by time
+        since = self.dwelling[train]
+        if time > since and not train.path and train.end is train.destination:
+            train.transferCargo(time - since, train.end)
+        self.dwelling[train] = time
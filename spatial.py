@@ -0,0 +1,121 @@
+from collections import defaultdict
+import math
+import utils
+
+
+class GridIndex(object):
+    # Uniform grid over points (anything with x and y, i.e. nodes and traders). Every item lives in the cell its
+    # position falls in, so finding what is at or near a position only looks at the cells around it. Items are
+    # expected not to move while indexed. Ties are won by the lowest id, i.e. the item created first, like a scan
+    # of the creation ordered lists the grid replaces.
+
+    def __init__(self, cell_size=4.0):
+        self.cell_size = float(cell_size)
+        self.cells = defaultdict(list)
+
+    def getCell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def add(self, item):
+        self.cells[self.getCell(item.x, item.y)].append(item)
+
+    def remove(self, item):
+        cell = self.getCell(item.x, item.y)
+        items = self.cells[cell]
+        items.remove(item)
+        if not items:
+            del self.cells[cell]
+
+    def getAt(self, x, y, accept=None):  # The item exactly at (x, y)
+        best = None
+        for item in self.cells.get(self.getCell(x, y), ()):
+            if item.x == x and item.y == y and (accept is None or accept(item)):
+                if best is None or item.id < best.id:
+                    best = item
+        return best
+
+    def getAround(self, x, y, radius):  # Every item in the cells that anything within radius of (x, y) can be in
+        min_cx, min_cy = self.getCell(x - radius, y - radius)
+        max_cx, max_cy = self.getCell(x + radius, y + radius)
+        for cx in xrange(min_cx, max_cx + 1):
+            for cy in xrange(min_cy, max_cy + 1):
+                for item in self.cells.get((cx, cy), ()):
+                    yield item
+
+    def getNearest(self, x, y, radius, accept=None):  # The closest item less than radius away from (x, y)
+        best = None
+        for item in self.getAround(x, y, radius):
+            dist = utils.getDistance((x, y), (item.x, item.y))
+            if dist < radius and (accept is None or accept(item)):
+                if best is None or (dist, item.id) < best[:2]:
+                    best = (dist, item.id, item)
+        return None if best is None else best[2]
+
+    def getWithin(self, x, y, radius, accept=None):  # Every item less than radius away from (x, y), by id
+        items = [item for item in self.getAround(x, y, radius)
+                 if utils.getDistance((x, y), (item.x, item.y)) < radius and (accept is None or accept(item))]
+        items.sort(key=lambda item: item.id)
+        return items
+
+
+class SegmentIndex(object):
+    # Uniform grid over edges. Every edge is listed in each cell its segment crosses, so finding the edge nearest
+    # to a position only looks at the edges around it, however much track there is elsewhere. Like the nodes at
+    # their ends, edges are expected not to move while indexed. Ties are won by the lowest pair of end ids.
+    margin = 1e-9  # Queries look this much further, for points that rounding puts on the wrong side of a cell border
+
+    def __init__(self, cell_size=4.0):
+        self.cell_size = float(cell_size)
+        self.cells = defaultdict(list)
+
+    def getCells(self, edge):  # Every cell the segment crosses, column by column
+        size = self.cell_size
+        (x0, y0), (x1, y1) = sorted(((edge.lnode.x, edge.lnode.y), (edge.hnode.x, edge.hnode.y)))
+        for cx in xrange(int(math.floor(x0 / size)), int(math.floor(x1 / size)) + 1):
+            if x0 == x1:
+                low_y, high_y = y0, y1
+            else:
+                slope = (y1 - y0) / float(x1 - x0)
+                low_y = y0 + (max(x0, cx * size) - x0) * slope
+                high_y = y0 + (min(x1, (cx + 1) * size) - x0) * slope
+            low_y, high_y = min(low_y, high_y), max(low_y, high_y)
+            for cy in xrange(int(math.floor(low_y / size)), int(math.floor(high_y / size)) + 1):
+                yield cx, cy
+
+    def add(self, edge):
+        for cell in self.getCells(edge):
+            self.cells[cell].append(edge)
+
+    def remove(self, edge):
+        for cell in self.getCells(edge):
+            edges = self.cells[cell]
+            edges.remove(edge)
+            if not edges:
+                del self.cells[cell]
+
+    def getNearest(self, x, y, radius):
+        # (distance, (lower id node, higher id node), closest point) of the closest edge, like
+        # utils.getPointClosestToSegment gives them, but only of edges at most radius away from (x, y). None if there
+        # are none.
+        reach = radius + self.margin
+        min_cx, min_cy = int(math.floor((x - reach) / self.cell_size)), int(math.floor((y - reach) / self.cell_size))
+        max_cx, max_cy = int(math.floor((x + reach) / self.cell_size)), int(math.floor((y + reach) / self.cell_size))
+        best = None
+        seen = set()
+        for cx in xrange(min_cx, max_cx + 1):
+            for cy in xrange(min_cy, max_cy + 1):
+                for edge in self.cells.get((cx, cy), ()):
+                    if edge in seen:
+                        continue
+                    seen.add(edge)
+                    lnode, hnode = edge.lnode, edge.hnode
+                    closest = utils.getPointClosestToSegment((lnode.x, lnode.y), (hnode.x, hnode.y), x, y)
+                    if closest is None or closest[0] > radius:
+                        continue
+                    key = closest[0], edge.lnode.id, edge.hnode.id
+                    if best is None or key < best[0]:
+                        best = key, ((edge.lnode, edge.hnode), closest[1])
+        if best is None:
+            return None
+        (distance, _, _), (n_edge, point) = best
+        return distance, n_edge, point
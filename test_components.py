@@ -0,0 +1,118 @@
+import pickle
+import random
+import unittest
+from engine import Graph
+
+
+def buildRing(graph, count):
+    # Nodes in a ring, which one removal doesn't split but two do
+    nodes = [graph.createNode(idx, idx % 2) for idx in range(count)]
+    for idx in range(count):
+        graph.connectNodes(nodes[idx], nodes[idx - 1])
+    return nodes
+
+
+def editGraph(graph, rnd):
+    # One random edit that may split or merge components
+    nodes = graph.nodes
+    op = rnd.random()
+    if len(nodes) < 10:  # Pruning took most of it away, lay some new track
+        graph.connectNodes(graph.createNode(rnd.random() * 40, 0), graph.createNode(rnd.random() * 40, 1))
+    elif op < 0.4:
+        graph.deleteEdge(*rnd.choice(sorted(graph.edges, key=lambda pair: (pair[0].id, pair[1].id))))
+    elif op < 0.6:
+        graph.deleteNode(rnd.choice(nodes))
+    elif op < 0.9:
+        from_, to = rnd.choice(nodes), rnd.choice(nodes)
+        if from_ is not to:
+            graph.connectNodes(from_, to)
+    else:
+        graph.connectNodes(graph.createNode(rnd.random() * 40, rnd.random() * 40), rnd.choice(nodes))
+
+
+def getLabels(graph):  # Component of every node, found breadth first
+    labels = {}
+    for node in graph.nodes:
+        if node not in labels:
+            labels[node] = node
+            todo = [node]
+            while todo:
+                for nbor in todo.pop().nbors:
+                    if nbor not in labels:
+                        labels[nbor] = node
+                        todo.append(nbor)
+    return labels
+
+
+class ComponentIndexTest(unittest.TestCase):
+
+    def assertComponents(self, graph):
+        labels = getLabels(graph)
+        for node in graph.nodes:
+            for other in graph.nodes:
+                self.assertEqual(graph.components.connected(node, other), labels[node] is labels[other],
+                                 (node, other))
+
+    def testSplitAndMerge(self):
+        graph = Graph()
+        nodes = buildRing(graph, 12)
+        graph.deleteEdge(nodes[0], nodes[11])
+        self.assertTrue(graph.components.connected(nodes[0], nodes[11]))
+        graph.deleteEdge(nodes[5], nodes[6])
+        self.assertFalse(graph.components.connected(nodes[0], nodes[11]))
+        self.assertTrue(graph.components.connected(nodes[0], nodes[5]))
+        merges = graph.components.merges
+        graph.connectNodes(nodes[5], nodes[6])
+        self.assertTrue(graph.components.connected(nodes[0], nodes[11]))
+        self.assertEqual(graph.components.merges, merges + 1)
+        graph.deleteNode(nodes[3])
+        self.assertComponents(graph)
+
+    def testSplitAndMergeInBatch(self):
+        graph = Graph()
+        nodes = buildRing(graph, 12)
+        with graph.batch():
+            graph.deleteEdge(nodes[0], nodes[11])
+            graph.deleteEdge(nodes[5], nodes[6])
+            graph.deleteNode(nodes[8])
+            graph.connectNodes(nodes[2], nodes[9])
+        self.assertIsNone(graph.components.suspects)
+        self.assertComponents(graph)
+        self.assertFalse(graph.components.connected(nodes[5], nodes[6]))
+        self.assertTrue(graph.components.connected(nodes[0], nodes[10]))
+
+    def testRandomEdits(self):
+        for seed in range(4):
+            rnd = random.Random(seed)
+            graph = Graph()
+            buildRing(graph, 30)
+            for burst in range(20):
+                if burst % 2:
+                    with graph.batch():
+                        with graph.batch():  # Only the outermost batch resolves
+                            for edit in range(rnd.randint(1, 12)):
+                                editGraph(graph, rnd)
+                        self.assertIsNotNone(graph.components.suspects)
+                else:
+                    for edit in range(rnd.randint(1, 12)):
+                        editGraph(graph, rnd)
+                        self.assertComponents(graph)
+                self.assertEqual(graph.batch_depth, 0)
+                self.assertComponents(graph)
+
+    def testPickleInBatch(self):
+        # A game saved by a tool in the middle of a batch has its components resolved once it is loaded
+        graph = Graph()
+        nodes = buildRing(graph, 12)
+        with graph.batch():
+            graph.deleteEdge(nodes[0], nodes[11])
+            graph.deleteEdge(nodes[5], nodes[6])
+            loaded = pickle.loads(pickle.dumps(graph, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(loaded.batch_depth, 0)
+        self.assertIsNone(loaded.components.suspects)
+        self.assertComponents(loaded)
+        self.assertComponents(graph)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import random
+import unittest
+from engine import Graph, Station, Signal
+from pathfinding import HeapBoy, PathCache, IncrementalBoy, Landmarks
+from overlay import OverlayBoy
+import utils
+
+
+class SoberBoy(object):
+    # The original A*, kept as the reference the other pathfinders are held to: goal on sight, the one-way rule,
+    # and ties going to the node most recently put on the open list
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    class DataItem(object):
+        def __init__(self, parent, g, h):
+            self.parent = parent
+            self.g = g
+            self.h = h
+
+    def findPath(self, start, end, destination):
+        if end is destination:
+            return [end]
+        node_data = {end: self.DataItem(None, 0, 0)}
+        open_list = [end]
+        closed_list = []
+        current_node = end
+        last_node = start  # For one-way rule
+        while True:
+            for nbor in current_node.nbors:
+                if nbor is destination:
+                    path = [nbor]
+                    node = current_node
+                    while node is not end:
+                        path.append(node)
+                        node = node_data[node].parent
+                    return list(reversed(path))
+
+                if nbor is last_node or nbor in closed_list:  # Enforce one-way rule (nbor is last_node)
+                    continue
+
+                edge = self.graph.getEdge(current_node, nbor)
+                if nbor in open_list:
+                    g = node_data[current_node].g + edge.length
+                    if g < node_data[nbor].g:
+                        node_data[nbor].g = g
+                        node_data[nbor].parent = current_node
+                else:
+                    node_data[nbor] = self.DataItem(current_node, node_data[current_node].g + edge.length,
+                                                    utils.getDistance((destination.x, destination.y), (nbor.x, nbor.y)))
+                open_list.append(nbor)
+
+            open_list.remove(current_node)
+            closed_list.append(current_node)
+            last_node = current_node
+
+            if not open_list:
+                return []
+
+            current_node = sorted([(node_data[node].g + node_data[node].h, node) for node in open_list],
+                                  key=lambda x: x[0], reverse=True)[-1][1]
+
+
+def buildGrid(rnd, size=8):
+    # A grid of track with some edges left out, stations every few nodes and signals on some edges
+    graph = Graph()
+    grid = {}
+    for i in range(size):
+        for j in range(size):
+            grid[i, j] = graph.createNode(i * 3, j * 3, Station if i % 4 == 0 and j % 4 == 0 else None)
+    for i in range(size):
+        for j in range(size):
+            if i + 1 < size and rnd.random() < 0.8:
+                graph.connectNodes(grid[i, j], grid[i + 1, j])
+            if j + 1 < size and rnd.random() < 0.8:
+                graph.connectNodes(grid[i, j], grid[i, j + 1])
+    for lnode, hnode in sorted(graph.edges, key=lambda pair: (pair[0].id, pair[1].id)):
+        if rnd.random() < 0.1 and Signal.type not in (lnode.type, hnode.type):
+            graph.insertNode(((lnode.x + hnode.x) / 2.0, (lnode.y + hnode.y) / 2.0), lnode, hnode, Signal.type)
+    return graph
+
+
+def editGraph(graph, rnd):
+    # One random edit of the kind the tools make
+    nodes = [node for node in graph.nodes if node.nbors]
+    op = rnd.random()
+    if op < 0.4:
+        graph.deleteEdge(*rnd.choice(sorted(graph.edges, key=lambda pair: (pair[0].id, pair[1].id))))
+    elif op < 0.55:
+        graph.deleteNode(rnd.choice([node for node in nodes if node.type is not Station.type]))
+    elif op < 0.85:
+        from_, to = rnd.choice(nodes), rnd.choice(nodes)
+        if from_ is not to and utils.getNodeDistance(from_, to) < 7:
+            graph.connectNodes(from_, to)
+    else:
+        node = graph.createNode(rnd.random() * 21, rnd.random() * 21)
+        graph.connectNodes(node, min((other for other in nodes), key=lambda other: utils.getNodeDistance(node, other)))
+
+
+class PathfinderTest(unittest.TestCase):
+    # Every pathfinder is kept alive over a series of random edits, as in a game, and asked for paths from random
+    # positions after each edit. HeapBoy has to find SoberBoy's very path. The others may break ties differently or
+    # find shorter paths, but have to find a path exactly when SoberBoy does, and a valid one.
+    seeds = range(3)
+    edits = 30
+    queries = 10
+
+    def makePathfinders(self, graph):
+        return {
+            'HeapBoy': PathCache(HeapBoy(graph)),
+            'IncrementalBoy': IncrementalBoy(graph),
+            'OverlayBoy': PathCache(OverlayBoy(graph, (Station.type,))),
+            'ALT': PathCache(HeapBoy(graph, Landmarks(4, (Station.type,)))),
+        }
+
+    def assertValidPath(self, name, start, end, destination, path):
+        self.assertEqual(path[-1], destination, name)
+        last_node, node = start, end
+        for next_node in path if path[0] is not end else path[1:]:
+            self.assertIn(next_node, node.nbors, name)
+            if node is end and next_node is not destination:  # Goal on sight comes before the one-way rule
+                self.assertIsNot(next_node, last_node, name + " broke the one-way rule")
+            last_node, node = node, next_node
+
+    def testAgainstSoberBoy(self):
+        for seed in self.seeds:
+            rnd = random.Random(seed)
+            graph = buildGrid(rnd)
+            reference = SoberBoy(graph)
+            pathfinders = self.makePathfinders(graph)
+            for edit in range(self.edits):
+                editGraph(graph, rnd)
+                nodes = [node for node in graph.nodes if node.nbors]
+                stations = [node for node in nodes if node.type is Station.type]
+                for query in range(self.queries):
+                    end = rnd.choice(nodes)
+                    start, destination = rnd.choice(end.nbors), rnd.choice(stations)
+                    expected = reference.findPath(start, end, destination)
+                    for name, pathfinder in sorted(pathfinders.items()):
+                        path = pathfinder.findPath(start, end, destination)
+                        if name == 'HeapBoy':
+                            self.assertEqual(path, expected, name)
+                        elif not expected:
+                            self.assertEqual(path, [], name)
+                        else:
+                            self.assertTrue(path, name)
+                            self.assertValidPath(name, start, end, destination, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+from bisect import bisect_right
+
+
+class Trail(object):
+    # The nodes a train has passed and its wagons may still be on, oldest first, along with how far along the track
+    # each one is from the first node ever added. Dropping the oldest node only moves first along; the lists are cut
+    # down in bulk, not on every drop, like a ring buffer. Finding the node a distance behind the train is a binary
+    # search over the distances.
+    __slots__ = ('nodes', 'edges', 'distances', 'first')
+
+    def __init__(self):
+        self.nodes = []
+        self.edges = []  # edges[i] joins nodes[i - 1] and nodes[i]
+        self.distances = []
+        self.first = 0  # Position of the oldest node still in the trail
+
+    def __len__(self):
+        return len(self.nodes) - self.first
+
+    def getLast(self):
+        return self.nodes[-1]
+
+    def getEnd(self):  # Distance of the newest node
+        return self.distances[-1]
+
+    def append(self, node):
+        if not len(self):
+            self.clear()
+        if self.nodes:
+            edge = self.nodes[-1].getEdge(node)
+            self.distances.append(self.distances[-1] + edge.length)
+        else:
+            edge = None
+            self.distances.append(0.0)
+        self.nodes.append(node)
+        self.edges.append(edge)
+
+    def popFirst(self):
+        self.first += 1
+        if self.first >= 16 and 2 * self.first > len(self.nodes):
+            del self.nodes[:self.first], self.edges[:self.first], self.distances[:self.first]
+            self.first = 0
+
+    def clear(self):
+        del self.nodes[:], self.edges[:], self.distances[:]
+        self.first = 0
+
+    def find(self, distance):
+        # Position of the last node at or before distance, or None if distance is before the oldest node
+        idx = bisect_right(self.distances, distance, self.first) - 1
+        return None if idx < self.first else idx
@@ -1,5 +1,10 @@
 import math
 
+try:  # Only needed by the batch functions, which work without it too, just not any faster
+    import numpy
+except ImportError:
+    numpy = None
+
 
 def getDistance(from_, to):
     return math.sqrt(float((from_[0] - to[0]) ** 2 + float((from_[1] - to[1]) ** 2)))
@@ -9,39 +14,36 @@ def getNodeDistance(from_, to):
     return getDistance((from_.x, from_.y), (to.x, to.y))
 
 
-def getPointClosestToEdge(nodes_pairs, mouse_x, mouse_y):
-    min_dist = None
-    for from_, to in nodes_pairs:
-        from_to_mouse = (mouse_x - from_.x, mouse_y - from_.y)
-        from_to_to = (to.x - from_.x, to.y - from_.y)
-        from_to_to_magnitude = from_to_to[0]**2 + from_to_to[1]**2
-        dot = from_to_mouse[0]*from_to_to[0]+from_to_mouse[1]*from_to_to[1]
-        distance_from_from = dot / float(from_to_to_magnitude)
-
-        if distance_from_from <= 0:
-            continue
-        elif distance_from_from > 1:
-            continue
+def getPointClosestToSegment(from_, to, mouse_x, mouse_y):
+    # (distance, closest point) of the segment between two points, or None if the closest point is an end
+    from_to_mouse = (mouse_x - from_[0], mouse_y - from_[1])
+    from_to_to = (to[0] - from_[0], to[1] - from_[1])
+    from_to_to_magnitude = from_to_to[0]**2 + from_to_to[1]**2
+    if not from_to_to_magnitude:  # Both ends in the same place, no point but the ends
+        return None
+    dot = from_to_mouse[0]*from_to_to[0]+from_to_mouse[1]*from_to_to[1]
+    distance_from_from = dot / float(from_to_to_magnitude)
 
-        closest_point = from_.x + from_to_to[0] * distance_from_from, \
-                        from_.y + from_to_to[1] * distance_from_from
+    if distance_from_from <= 0:
+        return None
+    elif distance_from_from > 1:
+        return None
 
-        distance = math.sqrt(float((mouse_x - closest_point[0]) ** 2) + float((mouse_y - closest_point[1]) ** 2))
+    closest_point = from_[0] + from_to_to[0] * distance_from_from, \
+                    from_[1] + from_to_to[1] * distance_from_from
 
-        if min_dist is None:
-            min_dist = (distance, (from_, to), closest_point)
-        elif distance < min_dist[0]:
-            min_dist = (distance, (from_, to), closest_point)
-    return min_dist
+    distance = math.sqrt(float((mouse_x - closest_point[0]) ** 2) + float((mouse_y - closest_point[1]) ** 2))
+    return distance, closest_point
 
 
 def getPointRelativeLine(start_point, relative_point, line_start, line_end):
+    # relative_point is turned to the direction of the line, i.e. (1, 0) is along it from line_end to line_start.
+    # The sine and cosine of the line's angle are just its direction, so no trigonometry is needed.
     x, y = relative_point
-    line_delta = tuple(x - y for x, y in zip(line_start, line_end))
-    line_angle = math.atan2(*line_delta) * 180 / math.pi
-    offset_x = (x * math.sin(line_angle * (math.pi / 180)) + y * math.sin((line_angle - 90) * (math.pi / 180)))
-    offset_y = (x * math.cos(line_angle * (math.pi / 180)) + y * math.cos((line_angle - 90) * (math.pi / 180)))
-    return start_point[0] + offset_x, start_point[1] + offset_y
+    delta_x, delta_y = line_start[0] - line_end[0], line_start[1] - line_end[1]
+    length = math.sqrt(delta_x ** 2 + delta_y ** 2)
+    sin, cos = (delta_x / length, delta_y / length) if length else (0.0, 1.0)
+    return start_point[0] + x * sin - y * cos, start_point[1] + x * cos + y * sin
 
 
 def getPointAlongLine(from_, to, pos):
@@ -61,3 +63,34 @@ def getAngleLockedPosition(angles, x, y):
     distance = (x * snap_x + y * snap_y) / float(snap_x ** 2 + snap_y ** 2)
     result_x, result_y = snap_x * distance, snap_y * distance
     return int(result_x + (0.1 if result_x >= 0 else -0.1)), int(result_y + (0.1 if result_y >= 0 else -0.1))
+
+
+# Batch versions of the above, over arrays of coordinates (lists, or NumPy arrays when NumPy is installed). They
+# return NumPy arrays when NumPy is installed, and lists otherwise.
+
+def getPointsAlongLines(from_xs, from_ys, to_xs, to_ys, positions):  # Returns (xs, ys)
+    if numpy is None:
+        points = [getPointAlongLine(from_, to, pos)
+                  for from_, to, pos in zip(zip(from_xs, from_ys), zip(to_xs, to_ys), positions)]
+        return [point[0] for point in points], [point[1] for point in points]
+    from_xs, from_ys = numpy.asarray(from_xs, dtype=float), numpy.asarray(from_ys, dtype=float)
+    positions = numpy.asarray(positions, dtype=float)
+    return from_xs + (to_xs - from_xs) * positions, from_ys + (to_ys - from_ys) * positions
+
+
+def getPointsRelativeLines(start_xs, start_ys, relative_point, line_start_xs, line_start_ys, line_end_xs,
+                           line_end_ys):  # Returns (xs, ys), with the same relative_point for every line
+    if numpy is None:
+        points = [getPointRelativeLine(start, relative_point, line_start, line_end)
+                  for start, line_start, line_end in zip(zip(start_xs, start_ys), zip(line_start_xs, line_start_ys),
+                                                         zip(line_end_xs, line_end_ys))]
+        return [point[0] for point in points], [point[1] for point in points]
+    x, y = relative_point
+    delta_x = numpy.subtract(line_start_xs, line_end_xs, dtype=float)
+    delta_y = numpy.subtract(line_start_ys, line_end_ys, dtype=float)
+    lengths = numpy.sqrt(delta_x ** 2 + delta_y ** 2)  # As getPointRelativeLine does
+    flat = lengths == 0
+    lengths[flat] = 1
+    sin, cos = delta_x / lengths, delta_y / lengths
+    cos[flat] = 1
+    return numpy.add(start_xs, x * sin) - y * cos, numpy.add(start_ys, x * cos) + y * sin  # In the same order, too